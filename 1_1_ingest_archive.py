@@ -0,0 +1,163 @@
+# This script is an alternative to step 2 of 1_crawl.py for large runs: commit information is read from local dump files
+# instead of the commits API, and appended to {ROOT_PATH}/commit_info/{lang}_commit_info.jsonl(.zst) in the same schema
+# 1. Supported inputs, plain or .gz, 1 JSON object per line:
+#    a. GH Archive (https://www.gharchive.org) hourly files, only PushEvent to the default branch of the top star repos is read
+#    b. exported rows of the BigQuery table bigquery-public-data.github_repos.commits
+# 2. The repos (and their default branches) come from {ROOT_PATH}/repo_info/{lang}_top_star_repos.jsonl written by 1_crawl.py
+# 3. Input files are read in parallel by a process pool, the main process de-duplicates the commits by sha
+#    (check seen_commits.py) and writes them. Ingested files are recorded, so the same file is never read twice
+# Dumps lack some fields of the API, they are filled as follows:
+#    - GH Archive: the committer date is the push time, the parent of a commit is the previous commit of the push
+#      (payload.before for the first one, none if the push lists fewer commits than payload.size), merges are not detected.
+#      The author / committer is the GitHub user of a noreply email if any, otherwise the pusher.
+#      Pushes without a commit list are skipped and counted
+#    - BigQuery: the author / committer is the GitHub user of a noreply email, otherwise unknown (rejected by rule 4 of step 2)
+import os
+import re
+import gzip
+import json
+import argparse
+from multiprocessing import Pool
+from datetime import datetime, timezone
+from tqdm import tqdm
+
+from commit_io import CommitWriter, parse_noreply_email
+from seen_commits import SeenCommits, get_seen_commits_path
+ROOT_PATH = './'
+GITHUB_URL = os.getenv("GITHUB_URL", "https://github.com")
+COMPRESS_COMMIT_INFO = False # same as 1_crawl.py
+NUM_WORKERS = os.cpu_count() # the number of input files read at the same time
+
+def open_dump(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', errors='replace')
+    return open(path, 'r', encoding='utf-8', errors='replace')
+
+def make_commit(repo_name, sha, message, date, parents, author, committer):
+    # the commit object in the schema of commit_io.project_commit
+    return {
+        "sha": sha,
+        "html_url": f"{GITHUB_URL}/{repo_name}/commit/{sha}",
+        "commit": {
+            "message": message,
+            "committer": {"date": date}
+        },
+        "author": author,
+        "committer": committer,
+        "parents": [{"sha": parent} for parent in parents]
+    }
+
+def parse_push_event(event, repos):
+    '''
+    Return the commits of a GH Archive PushEvent to the default branch of a wanted repo, newest first,
+    or None if the push lists no commits
+    '''
+    repo_name = event['repo']['name']
+    default_branch = repos.get(repo_name)
+    payload = event.get('payload') or {}
+    if default_branch is None or payload.get('ref') != f'refs/heads/{default_branch}':
+        return []
+    pusher_login = (event.get('actor') or {}).get('login')
+    pusher = None if pusher_login is None else {"login": pusher_login, "type": "Bot" if pusher_login.endswith("[bot]") else "User"}
+    if not payload.get('commits'):
+        return None if payload.get('size', 1) > 0 else []
+    commits = []
+    # a push of more commits than listed (truncated), the commit before the first listed one is unknown
+    parent = payload.get('before') if payload.get('size', len(payload['commits'])) == len(payload['commits']) else None
+    for commit in payload['commits']:
+        if commit.get('distinct', True): # not distinct: already pushed to another branch, and ingested from there
+            author = parse_noreply_email((commit.get('author') or {}).get('email', '')) or pusher
+            commits.append(make_commit(repo_name, commit['sha'], commit['message'], event['created_at'],
+                                       [] if parent is None or re.fullmatch('0+', parent) else [parent], author, pusher))
+        parent = commit['sha']
+    return commits[::-1]
+
+def parse_bigquery_row(row, repos):
+    '''
+    Return the commit of an exported row of github_repos.commits, 1 commit per wanted repo it belongs to
+    '''
+    def to_date(person):
+        # exported as either an ISO date string or seconds since epoch
+        if isinstance(person.get('date'), str):
+            return datetime.fromisoformat(person['date'].replace(' UTC', '+00:00').replace('Z', '+00:00')) \
+                .astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+        return datetime.fromtimestamp(int(person['time_sec']), timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+    repo_names = row.get('repo_name') or []
+    if isinstance(repo_names, str):
+        repo_names = [repo_names]
+    # exported rows may have null fields
+    author = parse_noreply_email((row.get('author') or {}).get('email') or '')
+    committer = parse_noreply_email((row.get('committer') or {}).get('email') or '')
+    return [make_commit(repo_name, row['commit'], (row.get('message') or '').rstrip('\n'), to_date(row.get('committer') or {}),
+                        row.get('parent') or [], author, committer)
+            for repo_name in repo_names if repo_name in repos]
+
+def ingest_file(args):
+    '''
+    Worker: read 1 dump file, return (path, commits of the wanted repos, number of pushes skipped without a commit list)
+    '''
+    path, repos = args
+    commits = []
+    skipped_push_num = 0
+    with open_dump(path) as f:
+        for line in f:
+            if line.strip() == '':
+                continue
+            try:
+                record = json.loads(line)
+                if record.get('type') == 'PushEvent':
+                    push_commits = parse_push_event(record, repos)
+                    if push_commits is None:
+                        skipped_push_num += 1
+                    else:
+                        commits += push_commits
+                elif 'commit' in record and 'repo_name' in record:
+                    commits += parse_bigquery_row(record, repos)
+            except (ValueError, KeyError, TypeError, AttributeError): # a broken record, skip it
+                continue
+    return path, commits, skipped_push_num
+
+def ingest(lang, input_paths, num_workers=NUM_WORKERS):
+    global ROOT_PATH
+    with open(os.path.join(ROOT_PATH, 'repo_info', f'{lang}_top_star_repos.jsonl'), 'r') as f:
+        repos_info = [json.loads(line) for line in f if line.strip() != '']
+    repos = {repo['full_name']: repo.get('default_branch') or 'master' for repo in repos_info}
+
+    os.makedirs(os.path.join(ROOT_PATH, 'commit_info'), exist_ok=True)
+    ingested_path = os.path.join(ROOT_PATH, 'commit_info', f'{lang}_ingested_files.json')
+    ingested = []
+    if os.path.exists(ingested_path):
+        with open(ingested_path, 'r') as f:
+            ingested = json.load(f)
+    ingested_set = set(ingested)
+    input_paths = [path for path in input_paths if os.path.abspath(path) not in ingested_set]
+    print(f"==> Ingest {len(input_paths)} dump files for {len(repos)} {lang} repos")
+
+    writer = CommitWriter(ROOT_PATH, lang, COMPRESS_COMMIT_INFO)
+    seen = SeenCommits(get_seen_commits_path(ROOT_PATH))
+    new_commit_num = 0
+    skipped_push_num = 0
+    with Pool(num_workers) as pool:
+        for path, commits, file_skipped_push_num in tqdm(pool.imap_unordered(ingest_file, [(path, repos) for path in input_paths]), total=len(input_paths)):
+            commits = seen.filter_commits(commits)
+            writer.write_all(commits)
+            new_commit_num += len(commits)
+            skipped_push_num += file_skipped_push_num
+            ingested.append(os.path.abspath(path))
+            with open(ingested_path + '.tmp', 'w') as f: # recorded after its commits are written
+                json.dump(ingested, f, indent=4)
+            os.replace(ingested_path + '.tmp', ingested_path)
+    seen.close()
+    print(f'{lang} have {new_commit_num} new commits')
+    if skipped_push_num > 0:
+        print(f'==> Skipped {skipped_push_num} pushes without a commit list, their commits are not ingested')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lang", default="python")
+    parser.add_argument("--root-path", default=ROOT_PATH)
+    parser.add_argument("--workers", type=int, default=NUM_WORKERS)
+    parser.add_argument("inputs", nargs="+", help="GH Archive hourly files or BigQuery exports (.json / .json.gz)")
+    args = parser.parse_args()
+    ROOT_PATH = args.root_path
+    ingest(args.lang, args.inputs, args.workers)
@@ -1,94 +1,248 @@
 # This script is used to crawl top star open source projects from GitHub by language
 # 1. It crawl the top k repositories' information, save to {ROOT_PATH}/repo_info/{lang}_top_star_repos.jsonl
 # 2. For each repository, it crawl all its commits' information, save to {ROOT_PATH}/commit_info/{lang}_commit_info.jsonl
-# 3. For each repository, it git clone the project to {ROOT_PATH}/repos/
+#    only the fields used by later steps are saved, check commit_io.project_commit
+#    the newest commit of each repo is recorded in {ROOT_PATH}/commit_info/{lang}_checkpoints.json, later runs only crawl newer commits
+#    (and the commits dated up to CHECKPOINT_WINDOW before it, check get_checkpoint_since)
+# 3. For each repository, it git clone the project to {ROOT_PATH}/repos/{owner}/{name}, together with step 2
+#    repos can be seeded from local mirrors / bundles, check repo_store.py
+#    if QUALIFY_REPOS, only after step 2: repos estimated to yield too few commits are deferred, check repo_qualifier.py
 import os
 import re
 import json
+import math
 import time
 import random
-import requests
+import asyncio
+import aiohttp
 import jsonlines
 import subprocess
 from tqdm import tqdm
+from contextlib import aclosing
+from importlib import import_module
+from datetime import datetime, timedelta
+from urllib.parse import urlparse, parse_qs
 
 from dotenv import load_dotenv
 from proxies_pool import proxy_list
-from user_agent_pool import user_agents    
+from live_proxy_pool import ProxyPool, load_proxy_file
+from github_client import GithubClient
+from token_scheduler import TokenScheduler, get_resource
+from response_cache import ResponseCache
+from commit_io import CommitWriter, parse_noreply_email
+from commit_store import open_commit_store
+from seen_commits import SeenCommits, get_seen_commits_path, is_fork_or_mirror
+from repo_store import get_config_path, get_full_name, get_repo_path, get_seed_source, migrate_legacy_repos
+from rule_engine import Rule, RuleEngine
+from repo_qualifier import check_commit_files, estimate_yield
+from telemetry import Metrics, DURATION_BUCKETS
 
 load_dotenv()
 GITHUB_TOKENS = os.getenv("GITHUB_TOKENS").split(',')
-CURR_TOKEN_IDX = 0
-GITHUB_TOKENS_RST_TIME = [time.time()-3600 for _ in range(len(GITHUB_TOKENS))]
 ROOT_PATH = './'
+# point them to fake_github.py to run the crawler offline
+GITHUB_API_URL = os.getenv("GITHUB_API_URL", "https://api.github.com")
+GITHUB_URL = os.getenv("GITHUB_URL", "https://github.com")
+MAX_CONCURRENCY_PER_TOKEN = 8 # the number of in-flight requests allowed for each token
+MAX_CONCURRENT_REPOS = 8 # the number of repos whose commits are crawled at the same time
+MAX_PAGES_IN_FLIGHT = 16 # the number of pages of 1 listing requested ahead of the page being consumed
+MAX_COMMITS_PER_REPO = None # at most crawl the newest k commits of each repo, None for no limit
+CRAWL_SINCE = None # only crawl commits within [CRAWL_SINCE, CRAWL_UNTIL], ISO 8601 like "2020-01-01T00:00:00Z", None for no limit
+CRAWL_UNTIL = None
+CHECKPOINT_WINDOW = 30 * 24 * 3600 # seconds, a later run also requests the commits dated this long before the checkpoint
+SEARCH_CAP = 1000 # GitHub only serves the first 1000 results of a search
+REPO_INFO_TTL = 7 * 24 * 3600 # seconds, the recorded top star repos are refreshed after this
+# 'rest': list commits with the REST API, 'graphql': only request the fields we need with the GraphQL API,
+# 'git': clone first and enumerate commits by git log, only the GitHub users of the commit emails are requested
+COMMIT_SOURCE = 'rest'
+GRAPHQL_REPOS_PER_QUERY = 10 # GraphQL mode, the number of repos requested in 1 query
+GRAPHQL_USERS_PER_QUERY = 100 # git mode, the number of commit emails resolved in 1 query
+GRAPHQL_URL = f"{GITHUB_API_URL}/graphql"
+COMPRESS_COMMIT_INFO = False # write {lang}_commit_info.jsonl.zst instead, requires zstandard
+KEEP_RAW_COMMIT_INFO = False # besides the projected commits, also keep the raw API payloads in {lang}_commit_info_raw.jsonl
+# labels of the rules of 2_clean_commit_info.commit_filter applied while crawling, only the ones reading commit metadata:
+# '2' non-ascii message, '3' word count, '4' author / committer not a User, '7' merge. Rejected commits are not written
+# (their raw payloads still are, if KEEP_RAW_COMMIT_INFO), clean_commit still applies every rule
+CRAWL_FILTER_RULES = [] # e.g. ['2', '3', '4', '7']
+KEEP_CRAWL_REJECTS = True # record {sha, html_url, rule} of rejected commits in {lang}_rejected_commits.jsonl, False to drop them
+MAX_CONCURRENT_CLONES = 4 # the number of repos cloned / fetched at the same time
+# 'full': full clone, 'blobless' / 'treeless': partial clone, missing objects are fetched on demand by later git commands,
+# 'mirror': bare mirror, no work tree on disk (git diff between commits still works)
+CLONE_MODE = 'full'
+CLONE_OPTIONS = {
+    'full': [],
+    'blobless': ['--filter=blob:none'],
+    'treeless': ['--filter=tree:0'],
+    'mirror': ['--mirror']
+}
+REPO_MIRROR_DIR = None # a directory of bare mirrors {owner}/{name}.git (e.g. a store shared by workers), repos are seeded from it
+REPO_BUNDLE_DIR = None # a directory of git bundles {owner}/{name}.bundle, repos are seeded from it
+SHARE_MIRROR_OBJECTS = True # repos seeded from a mirror borrow its objects by objects/info/alternates instead of copying them,
+                            # the mirror then must never be pruned, check git_clone_async
+DEDUPE_COMMITS = True # drop commits whose sha has been crawled from another repo / language, check seen_commits.py
+SKIP_FORKS = True # do not crawl forks and mirrors among the top star repos, if False a fork borrows the objects of its parent clone
+# rest / graphql mode, sample the candidate commits of each repo from the API before cloning it,
+# repos estimated to yield fewer than QUALIFY_MIN_YIELD commits passing 3_clean_edit_info are deferred (not cloned).
+# Off by default: it costs QUALIFY_SAMPLE_SIZE core requests per repo, and the repos are only cloned after all commits are crawled
+QUALIFY_REPOS = False
+QUALIFY_SAMPLE_SIZE = 10 # the number of candidate commits requested for each repo
+QUALIFY_MIN_YIELD = 5
+TOKEN_STATE_PATH = os.path.join(ROOT_PATH, 'token_state.json') # shared by all crawler processes, set None to keep it in memory
+CACHE_PATH = os.path.join(ROOT_PATH, 'http_cache.sqlite') # set None to disable the response cache
+CACHE_MAX_BYTES = 20 * 1024**3 # the least recently used responses are evicted beyond this size
+OFFLINE = False # if True, only replay cached responses, never send requests to GitHub (GraphQL requests fail, they are not cached)
+USE_PROXY_POOL = True # if False, always connect to GitHub directly
+PROXY_FILE = os.path.join(ROOT_PATH, 'proxies_pool.txt') # written by proxy.py, re-read by the proxy pool periodically
+METRICS_JSON_PATH = os.path.join(ROOT_PATH, 'crawl_metrics.json') # set None to disable
+METRICS_PROMETHEUS_PATH = os.path.join(ROOT_PATH, 'crawl_metrics.prom') # for the textfile collector of node_exporter, set None to disable
+METRICS_FLUSH_INTERVAL = 30 # seconds
+CLIENT = GithubClient(max_concurrency_per_token=MAX_CONCURRENCY_PER_TOKEN)
+SCHEDULER = TokenScheduler(GITHUB_TOKENS, TOKEN_STATE_PATH)
+CACHE = ResponseCache(CACHE_PATH, CACHE_MAX_BYTES) if CACHE_PATH is not None else None
+PROXY_POOL = ProxyPool([lambda: proxy_list, lambda: load_proxy_file(PROXY_FILE)]) if USE_PROXY_POOL else None
+METRICS = Metrics()
 
-def get_response(request_url, params=None):
-    global CURR_TOKEN_IDX
+async def request_async(request_url, params=None, json_body=None):
+    '''
+    Send a GET request, or a POST request if json_body is given (GraphQL).
+    Return the content of the response, and its pagination Link header (None if it has no Link header)
+    '''
     MAX_RETRIES = 10
-    headers = {
-        'User-Agent': random.choice(user_agents),
-        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-        'Authorization':'token '+ GITHUB_TOKENS[CURR_TOKEN_IDX],
-        'Accept-Encoding': 'gzip,deflate,sdch',
-        'Accept-Language': 'zh-CN,zh;q=0.8'
-    }
-    for i in range(MAX_RETRIES):
-        proxy = random.choice(proxy_list)
+    resource = get_resource(request_url)
+    # GraphQL responses have no ETag, only GET requests are cached
+    cached = CACHE.get(request_url, params) if CACHE is not None and json_body is None else None
+    if OFFLINE:
+        if json_body is not None: # GraphQL responses are not cached, there is nothing to replay
+            raise ConnectionError(f"Offline mode, GraphQL requests are not cached: {request_url}")
+        if cached is None:
+            raise ConnectionError(f"Offline mode, response not cached: {request_url}, params: {params}")
+        METRICS.inc("github_cache_hits_total", resource=resource)
+        return cached[2], cached[3]
+    conditional_headers = CACHE.get_conditional_headers(cached) if CACHE is not None else None
+    if PROXY_POOL is not None:
+        PROXY_POOL.start_refresh()
+    if METRICS_JSON_PATH is not None or METRICS_PROMETHEUS_PATH is not None:
+        METRICS.start_flush(METRICS_FLUSH_INTERVAL, METRICS_JSON_PATH, METRICS_PROMETHEUS_PATH)
+    i = 0
+    while True:
+        token, wait = await asyncio.to_thread(SCHEDULER.acquire, resource) # it blocks on the shared state file
+        if token is None: # waiting for the rate limit to reset does not count as a retry
+            print(f"==> All tokens have been used up, sleep {wait:.0f} seconds until next token is available")
+            METRICS.inc("github_rate_limit_sleep_seconds_total", wait, resource=resource)
+            await asyncio.sleep(wait)
+            continue
+        proxy = PROXY_POOL.choose() if PROXY_POOL is not None else None
+        via = "direct" if proxy is None else "proxy"
+        start = time.time()
         try:
-            r = requests.get(request_url, params, headers=headers,
-                            proxies={"http": proxy}, timeout=40)
-        except requests.exceptions.RequestException as e:
+            status, headers, content = await CLIENT.request("GET" if json_body is None else "POST",
+                                                            request_url, params, token, proxy=proxy,
+                                                            headers=conditional_headers, json_body=json_body)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            METRICS.observe("github_request_seconds", time.time() - start, resource=resource, status="error", via=via)
+            if PROXY_POOL is not None:
+                PROXY_POOL.report(proxy, False, time.time() - start)
             if i < MAX_RETRIES - 1:
+                METRICS.inc("github_retries_total", resource=resource, status="error")
+                i += 1
                 continue
             raise Exception(e)
 
-        if r.status_code == 200:
-            break # if successfully get response, break the loop and return content
-        else:
-            if r.status_code == 403: # if the request budget has been used up, sleep for 1 hour
-                print("==> 403 Forbidden, the request budget has been used up")
-                print("==> Switch to another token")
-                GITHUB_TOKENS_RST_TIME[CURR_TOKEN_IDX] = time.time()
-                CURR_TOKEN_IDX = (CURR_TOKEN_IDX + 1) % len(GITHUB_TOKENS)
-                headers = { # update the headers
-                    'User-Agent': random.choice(user_agents),
-                    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-                    'Authorization':'token '+ GITHUB_TOKENS[CURR_TOKEN_IDX],
-                    'Accept-Encoding': 'gzip,deflate,sdch',
-                    'Accept-Language': 'zh-CN,zh;q=0.8'
-                }
-                if GITHUB_TOKENS_RST_TIME[CURR_TOKEN_IDX] + 3600 > time.time():
-                    print("==> All tokens have been used up, sleep until next token is available")
-                    time.sleep(3600-(time.time()-GITHUB_TOKENS_RST_TIME[CURR_TOKEN_IDX])+10)
-            else: # other errors, sleep for 1 second
-                time.sleep(1)
-            if i == MAX_RETRIES - 1: # if all retries failed, raise error
-                raise ConnectionError(f"Cannot connect to website: {request_url}, status code: {r.status_code}")
-    return r.content
+        METRICS.observe("github_request_seconds", time.time() - start, resource=resource, status=str(status), via=via)
+        METRICS.inc("github_response_bytes_total", len(content), resource=resource)
+        if 'X-RateLimit-Remaining' in headers: # only the end of the token is shown
+            METRICS.set("github_quota_remaining", int(headers['X-RateLimit-Remaining']), token="..." + token[-4:], resource=resource)
+        if PROXY_POOL is not None: # 5xx and 407 (proxy authentication) are blamed on the proxy, rate limits are not
+            PROXY_POOL.report(proxy, status < 500 and status != 407, time.time() - start)
+        rate_limited = await asyncio.to_thread(SCHEDULER.update, token, resource, status, headers, content)
+        if status == 304: # not modified since cached, free of rate limit
+            METRICS.inc("github_cache_hits_total", resource=resource)
+            return cached[2], headers.get('Link', cached[3])
+        if status == 200:
+            if CACHE is not None and json_body is None:
+                CACHE.put(request_url, params, headers, content)
+            return content, headers.get('Link') # if successfully get response, return content
+        METRICS.inc("github_retries_total", resource=resource, status=str(status))
+        if rate_limited: # the next request will be sent with another token, or wait for the reset
+            print(f"==> {status}, the request budget of this token has been used up, switch to another token")
+            continue
+        await asyncio.sleep(1) # other errors, sleep for 1 second
+        if i == MAX_RETRIES - 1: # if all retries failed, raise error
+            raise ConnectionError(f"Cannot connect to website: {request_url}, status code: {status}")
+        i += 1
 
-def get_all_response(request_url, params=None):
+async def get_response_async(request_url, params=None):
+    content, _ = await request_async(request_url, params)
+    return content
+
+def get_response(request_url, params=None):
+    # sync wrapper of get_response_async
+    return CLIENT.run(get_response_async(request_url, params))
+
+def get_last_page(link):
+    # parse the index of the last page from Link header: <https://api.github.com/...&page=34>; rel="last"
+    if link is None:
+        return None
+    match = re.search(r'<([^>]+)>;\s*rel="last"', link)
+    if match is None:
+        return None
+    page = parse_qs(urlparse(match.group(1)).query).get('page')
+    return int(page[0]) if page else None
+
+async def iter_all_response_async(request_url, params=None, max_pages=None):
     '''
-    Regardless of the number of pages and the request page index, get all the response
+    Yield the items of every page (at most max_pages pages) in page order.
+    The number of pages is read from the Link header of the first page, the other pages are requested
+    concurrently, at most MAX_PAGES_IN_FLIGHT pages ahead of the page being yielded
     '''
     if params == None:
         params = {
             "per_page": '100', 
             "page": "1"
         }
-    all_d = []
     per_page = int(params['per_page'])
-    params['page'] = 1
-    while True:
-        content = get_response(request_url, params)
-        d = json.loads(content)
+    content, link = await request_async(request_url, {**params, 'page': 1})
+    d = json.loads(content)
+    yield d
+    last_page = get_last_page(link)
+    if last_page is None: # no Link header, fall back to request page by page
+        page = 1
+        while len(d) >= per_page and (max_pages is None or page < max_pages):
+            page += 1
+            d = json.loads(await get_response_async(request_url, {**params, 'page': page}))
+            yield d
+        return
+    if max_pages is not None: # a page requested ahead and then cancelled still costs a request
+        last_page = min(last_page, max_pages)
+
+    pending = []
+    next_page = 2
+    try:
+        while next_page <= last_page or pending:
+            while next_page <= last_page and len(pending) < MAX_PAGES_IN_FLIGHT:
+                pending.append(asyncio.ensure_future(get_response_async(request_url, {**params, 'page': next_page})))
+                next_page += 1
+            d = json.loads(await pending.pop(0))
+            yield d
+    finally: # the caller stops early or a page fails, do not leave requests behind
+        for task in pending:
+            task.cancel()
+
+async def get_all_response_async(request_url, params=None):
+    '''
+    Regardless of the number of pages and the request page index, get all the response
+    '''
+    all_d = []
+    start = time.time()
+    async for d in iter_all_response_async(request_url, params):
         all_d.extend(d)
-        if len(d) < per_page:
-            break
-        else:
-            params['page'] += 1
-            time.sleep(1)
+    METRICS.observe("github_listing_seconds", time.time() - start, buckets=DURATION_BUCKETS, resource=get_resource(request_url))
     return all_d
 
+def get_all_response(request_url, params=None):
+    # sync wrapper of get_all_response_async
+    return CLIENT.run(get_all_response_async(request_url, params))
+
 def get_small_response(request_url, params=None):
     '''
     only get 1 page with 5 items, for test, remove it later
@@ -102,119 +256,761 @@ def get_small_response(request_url, params=None):
     d = json.loads(content)
     return d
 
-def get_repos(lang, repo_num):
-    # get the top star repos' information of this language
-    repos = []
-    for page_idx in range(1, repo_num // 100 + 2):
-        request_url = "https://api.github.com/search/repositories"
-        params = {
-            "q": "language:{} stars:>500".format(lang),
-            "page": "{}".format(str(page_idx)),
-            "per_page": "100",
-            "sort": "stars",
-            "order": "desc",
-            "license": "mit",
-        }
-        content = get_response(request_url, params)
-        d = json.loads(content)
-        items = d["items"]
-
-        for item in items:
-            title = item["full_name"]
-            url = item["html_url"]
-            date_time = item["updated_at"]
-            description = item["description"]
-            stars = item["stargazers_count"]
-            line = u"* [{title}]({url})|{stars}|{date_time}|:\n {description}\n". \
-                format(title=title, date_time=date_time, url=url, description=description, stars=stars)
-            print(line)
-            repos.append(item)
-            if len(repos) >= repo_num:
-                break
+async def search_repos_async(query, page_idx, per_page=100):
+    request_url = f"{GITHUB_API_URL}/search/repositories"
+    params = {
+        "q": query,
+        "page": "{}".format(str(page_idx)),
+        "per_page": str(per_page),
+        "sort": "stars",
+        "order": "desc",
+        "license": "mit",
+    }
+    content = await get_response_async(request_url, params)
+    return json.loads(content)
+
+async def count_repos_async(query):
+    return (await search_repos_async(query, 1, per_page=1))["total_count"]
+
+async def search_partition_async(lang, low, high, created=None):
+    '''
+    Get all the repos of this language with low <= stars <= high (and created within the created date range).
+    A partition with more than SEARCH_CAP results is split in half by stars, or by creation date if low == high,
+    and the halves are searched concurrently
+    '''
+    query = f"language:{lang} stars:{low}..{high}"
+    if created is not None:
+        query += f" created:{created[0]}..{created[1]}"
+    first_page = await search_repos_async(query, 1)
+    total = first_page["total_count"]
+    if total > SEARCH_CAP and low < high:
+        mid = (low + high) // 2
+        halves = await asyncio.gather(search_partition_async(lang, mid + 1, high, created),
+                                      search_partition_async(lang, low, mid, created))
+        return halves[0] + halves[1]
+    if total > SEARCH_CAP:
+        start, end = created if created is not None else ("2008-01-01", time.strftime("%Y-%m-%d"))
+        start_time = time.mktime(time.strptime(start, "%Y-%m-%d"))
+        end_time = time.mktime(time.strptime(end, "%Y-%m-%d"))
+        if end_time - start_time >= 2 * 86400:
+            mid = time.strftime("%Y-%m-%d", time.localtime((start_time + end_time) / 2))
+            next_day = time.strftime("%Y-%m-%d", time.localtime(time.mktime(time.strptime(mid, "%Y-%m-%d")) + 86400))
+            halves = await asyncio.gather(search_partition_async(lang, low, high, (start, mid)),
+                                          search_partition_async(lang, low, high, (next_day, end)))
+            return halves[0] + halves[1]
+        print(f"==> Can not split {query} any further, only the first {SEARCH_CAP} repos are available")
+        total = SEARCH_CAP
+    pages = await asyncio.gather(*[search_repos_async(query, page_idx) for page_idx in range(2, (min(total, SEARCH_CAP) - 1) // 100 + 2)])
+    items = first_page["items"]
+    for page in pages:
+        items += page["items"]
+    return items
+
+async def find_star_threshold_async(lang, repo_num, max_stars):
+    # binary search the largest star count t so that at least repo_num repos have stars in [t, max_stars]
+    low, high = 501, max_stars
+    while low < high:
+        mid = (low + high + 1) // 2
+        if await count_repos_async(f"language:{lang} stars:{mid}..{max_stars}") >= repo_num:
+            low = mid
+        else:
+            high = mid - 1
+    return low
+
+async def get_repos_async(lang, repo_num, max_stars=None):
+    '''
+    Get the top star repos' information of this language (only repos with stars <= max_stars if given).
+    GitHub serves at most SEARCH_CAP results of 1 search, so for more repos, the search space is partitioned by stars and creation date
+    '''
+    query = f"language:{lang} stars:>500" if max_stars is None else f"language:{lang} stars:501..{max_stars}"
+    if repo_num <= SEARCH_CAP: # all result pages are requested concurrently
+        pages = await asyncio.gather(*[search_repos_async(query, page_idx) for page_idx in range(1, (repo_num - 1) // 100 + 2)])
+        items = []
+        for page in pages:
+            items += page["items"]
+    else:
+        if max_stars is None:
+            top = (await search_repos_async(query, 1, per_page=1))["items"]
+            if len(top) == 0:
+                raise Exception("No repos found")
+            max_stars = top[0]["stargazers_count"]
+        threshold = await find_star_threshold_async(lang, repo_num, max_stars)
+        items = await search_partition_async(lang, threshold, max_stars)
+
+    # partitions may overlap when stars change during the search, de-duplicate and order by stars again
+    repos = {}
+    for item in items:
+        repos[item["full_name"]] = item
+    repos = sorted(repos.values(), key=lambda item: -item["stargazers_count"])[:repo_num]
+    for item in repos:
+        title = item["full_name"]
+        url = item["html_url"]
+        date_time = item["updated_at"]
+        description = item["description"]
+        stars = item["stargazers_count"]
+        line = u"* [{title}]({url})|{stars}|{date_time}|:\n {description}\n". \
+            format(title=title, date_time=date_time, url=url, description=description, stars=stars)
+        print(line)
     if len(repos) == 0:
         raise Exception("No repos found")
     return repos
 
-def git_clone(user_name, proj_name):
-    # Check if this repo has been downloaded
-    global ROOT_PATH
-    global GITHUB_TOKENS, CURR_TOKEN_IDX
-    
-    if not os.path.exists(ROOT_PATH+'/repos'):
-        os.mkdir(ROOT_PATH+'/repos')
-    if os.path.exists(ROOT_PATH+f'/repos/{proj_name}/'):
-        result = subprocess.run(
-            "git remote show origin | grep 'HEAD branch'",
-            shell=True,
-            text=True,
-            capture_output=True,
-            check=True,
-            cwd=os.path.normpath(ROOT_PATH+'/repos/'+proj_name)
-        )
-        branch_name = result.stdout.split(":")[1].strip()
+def get_repos(lang, repo_num, max_stars=None):
+    # sync wrapper of get_repos_async
+    return CLIENT.run(get_repos_async(lang, repo_num, max_stars))
+
+def update_repos(lang, repo_num):
+    '''
+    Get the top repo_num repos of this language, from {ROOT_PATH}/repo_info/{lang}_top_star_repos.jsonl if it is younger than REPO_INFO_TTL.
+    If the recorded repos are not enough, only the missing repos (with fewer stars than the recorded ones) are requested
+    '''
+    repo_info_path = ROOT_PATH+f"/repo_info/{lang}_top_star_repos.jsonl"
+    meta_path = ROOT_PATH+f"/repo_info/{lang}_top_star_repos.meta.json"
+    repos = []
+    if os.path.exists(repo_info_path):    # if have recorded repos before
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r') as f:
+                fetched_at = json.load(f)["fetched_at"]
+        else: # recorded by an older version
+            fetched_at = os.path.getmtime(repo_info_path)
+        if time.time() - fetched_at < REPO_INFO_TTL:
+            # open recorded repo info
+            with jsonlines.open(repo_info_path) as reader:
+                print(f"==> {lang}_top_star_repos.jsonl exists, read from local")
+                repos = list(reader)
+        else:
+            print(f"==> {lang}_top_star_repos.jsonl is older than {REPO_INFO_TTL} seconds, refresh it")
+    if len(repos) >= repo_num:
+        return repos
+    if len(repos) == 0:
+        repos = get_repos(lang, repo_num) # get the desired number of repos
+        fetched_at = time.time()
+    else: # if the number of repo has not been satisfied, only get the missing repos
+        min_stars = repos[-1]["stargazers_count"]
+        known = set(repo["full_name"] for repo in repos)
+        # repos with exactly min_stars may have been recorded already
+        overlap = sum(1 for repo in repos if repo["stargazers_count"] == min_stars)
+        try:
+            more = get_repos(lang, repo_num - len(repos) + overlap, max_stars=min_stars)
+        except Exception as e:
+            print(f"==> Fail to get more repos: {e}")
+            more = []
+        repos += [repo for repo in more if repo["full_name"] not in known][:repo_num - len(repos)]
+    # save repo info
+    with jsonlines.open(repo_info_path, 'w') as writer:
+        writer.write_all(repos)
+    with open(meta_path, 'w') as f:
+        json.dump({"fetched_at": fetched_at}, f)
+    return repos
+
+def load_checkpoints(lang):
+    # checkpoint of each repo: the newest commit crawled so far, so that later runs only request newer commits
+    checkpoint_path = os.path.join(ROOT_PATH, 'commit_info', f'{lang}_checkpoints.json')
+    if not os.path.exists(checkpoint_path):
+        return {}
+    with open(checkpoint_path, 'r') as f:
+        return json.load(f)
+
+def save_checkpoints(lang, checkpoints):
+    checkpoint_path = os.path.join(ROOT_PATH, 'commit_info', f'{lang}_checkpoints.json')
+    with open(checkpoint_path + '.tmp', 'w') as f:
+        json.dump(checkpoints, f, indent=4)
+    os.replace(checkpoint_path + '.tmp', checkpoint_path) # never leave a half written checkpoint behind
+
+def shift_date(date, seconds):
+    # the date format of the API, e.g. 2020-01-01T00:00:00Z
+    shifted = datetime.fromisoformat(date.replace('Z', '+00:00')) + timedelta(seconds=seconds)
+    return shifted.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+def get_checkpoint_since(checkpoint):
+    '''
+    The since of the next crawl of a repo. Commits are filtered by their commit date, a commit merged after the checkpoint
+    may be dated before it, so the commits dated up to CHECKPOINT_WINDOW before the checkpoint are requested again,
+    those crawled before are skipped by their sha (check get_known_shas)
+    '''
+    since = CRAWL_SINCE
+    if checkpoint is not None:
+        window_start = shift_date(checkpoint['newest_date'], -CHECKPOINT_WINDOW)
+        if since is None or window_start > since:
+            since = window_start
+    return since
+
+def get_known_shas(checkpoint):
+    # the crawled commits the next crawl of a repo requests again, checkpoints of older versions only record the newest one
+    if checkpoint is None:
+        return set()
+    return set(checkpoint.get('recent', {checkpoint['newest_sha']: checkpoint['newest_date']}))
+
+def update_checkpoint(checkpoint, commits):
+    '''
+    Return the checkpoint of a repo after its new commits are crawled: the newest commit, and {sha: date} of
+    the commits within CHECKPOINT_WINDOW before it
+    '''
+    recent = dict(checkpoint.get('recent', {checkpoint['newest_sha']: checkpoint['newest_date']})) if checkpoint else {}
+    recent.update({commit['sha']: commit['commit']['committer']['date'] for commit in commits})
+    newest_sha = max(recent, key=recent.get)
+    window_start = shift_date(recent[newest_sha], -CHECKPOINT_WINDOW)
+    return {
+        "newest_sha": newest_sha,
+        "newest_date": recent[newest_sha],
+        "num_commits": len(commits) + (checkpoint['num_commits'] if checkpoint else 0),
+        "recent": {sha: date for sha, date in recent.items() if date >= window_start}
+    }
+
+async def get_repo_commits_async(user_name, proj_name, checkpoint=None):
+    '''
+    Get the commits of 1 repo within [CRAWL_SINCE, CRAWL_UNTIL], newest first, at most MAX_COMMITS_PER_REPO commits.
+    If the repo has a checkpoint, only the commits not crawled yet since get_checkpoint_since are requested
+    '''
+    params = {
+        "per_page": '100',
+        "page": "1"
+    }
+    since = get_checkpoint_since(checkpoint)
+    known_shas = get_known_shas(checkpoint)
+    if since is not None:
+        params['since'] = since
+    if CRAWL_UNTIL is not None:
+        params['until'] = CRAWL_UNTIL
+    commits = []
+    request_url = f"{GITHUB_API_URL}/repos/{user_name}/{proj_name}/commits"
+    max_pages = None
+    if MAX_COMMITS_PER_REPO is not None: # the commits of last run within the window may be listed again
+        max_pages = math.ceil((MAX_COMMITS_PER_REPO + len(known_shas)) / int(params['per_page']))
+    start = time.time()
+    try:
+        async with aclosing(iter_all_response_async(request_url, params, max_pages)) as pages:
+            async for d in pages:
+                for commit in d:
+                    if commit['sha'] in known_shas: # crawled by the last run, within the window before the checkpoint
+                        continue
+                    commits.append(commit)
+                    if MAX_COMMITS_PER_REPO is not None and len(commits) >= MAX_COMMITS_PER_REPO:
+                        return commits
+        return commits
+    finally:
+        METRICS.observe("github_listing_seconds", time.time() - start, buckets=DURATION_BUCKETS, resource="core")
+
+GRAPHQL_HISTORY_FIELDS = '''
+pageInfo { hasNextPage endCursor }
+nodes {
+    oid
+    url
+    message
+    committedDate
+    author { user { login } }
+    committer { user { login } }
+    parents(first: 2) { nodes { oid } }
+}'''
+
+def graphql_node_to_commit(node):
+    # convert a GraphQL commit node to the fields of a REST commit object that the later steps read
+    def to_user(actor):
+        # GitAuthor.user is only set for real GitHub users, bots and unknown emails have no user
+        if actor is None or actor['user'] is None:
+            return None
+        return {"login": actor['user']['login'], "type": "User"}
+    return {
+        "sha": node['oid'],
+        "html_url": node['url'],
+        "commit": {
+            "message": node['message'],
+            "committer": {"date": node['committedDate']}
+        },
+        "author": to_user(node['author']),
+        "committer": to_user(node['committer']),
+        "parents": [{"sha": parent['oid']} for parent in node['parents']['nodes']]
+    }
+
+async def get_repos_commits_graphql_async(titles, checkpoints):
+    '''
+    Get the commits of several repos with GraphQL, 1 query (1 alias per repo) requests the next page of every repo left.
+    Same limits as get_repo_commits_async. Return {full_name: commits}, commits is None if the repo can not be crawled
+    '''
+    cursors = {title: None for title in titles}
+    results = {title: [] for title in titles}
+    active = list(titles)
+    start = time.time()
+    while len(active) > 0:
+        queries = []
+        for alias_idx, title in enumerate(active):
+            user_name, proj_name = re.match('(.+)/(.+)', title).groups()
+            first = 100
+            if MAX_COMMITS_PER_REPO is not None:
+                first = min(first, MAX_COMMITS_PER_REPO - len(results[title]))
+            args = [f'first: {first}']
+            if cursors[title] is not None:
+                args.append(f'after: {json.dumps(cursors[title])}')
+            since = get_checkpoint_since(checkpoints.get(title))
+            if since is not None:
+                args.append(f'since: {json.dumps(since)}')
+            if CRAWL_UNTIL is not None:
+                args.append(f'until: {json.dumps(CRAWL_UNTIL)}')
+            queries.append(f'r{alias_idx}: repository(owner: {json.dumps(user_name)}, name: {json.dumps(proj_name)}) {{ '
+                           f'defaultBranchRef {{ target {{ ... on Commit {{ history({", ".join(args)}) {{ {GRAPHQL_HISTORY_FIELDS} }} }} }} }} }}')
+        content, _ = await request_async(GRAPHQL_URL, json_body={"query": "query { " + "\n".join(queries) + " }"})
+        data = json.loads(content).get('data') or {}
+
+        still_active = []
+        for alias_idx, title in enumerate(active):
+            repo_data = data.get(f'r{alias_idx}')
+            if repo_data is None: # e.g. the repo is deleted or renamed
+                results[title] = None
+                continue
+            if repo_data['defaultBranchRef'] is None: # empty repo
+                continue
+            history = repo_data['defaultBranchRef']['target']['history']
+            known_shas = get_known_shas(checkpoints.get(title))
+            done = False
+            for node in history['nodes']:
+                if node['oid'] in known_shas: # crawled by the last run, within the window before the checkpoint
+                    continue
+                results[title].append(graphql_node_to_commit(node))
+                if MAX_COMMITS_PER_REPO is not None and len(results[title]) >= MAX_COMMITS_PER_REPO:
+                    done = True
+                    break
+            if not done and history['pageInfo']['hasNextPage']:
+                cursors[title] = history['pageInfo']['endCursor']
+                still_active.append(title)
+        for title in set(active) - set(still_active): # the listing of this repo is done
+            METRICS.observe("github_listing_seconds", time.time() - start, buckets=DURATION_BUCKETS, resource="graphql")
+        active = still_active
+    return results
+
+GIT_LOG_FORMAT = "%H%x00%P%x00%cd%x00%ae%x00%ce%x00%B%x1e"
+EMAIL_USERS = {} # git mode, commit email -> GitHub user ({"login", "type"} or None), shared by the repos of 1 run
+
+async def get_repo_commits_git_async(user_name, proj_name, checkpoint=None):
+    '''
+    Same as get_repo_commits_async, but the commits are enumerated from the local clone {ROOT_PATH}/repos/{user_name}/{proj_name} by git log.
+    Message, date and parents come from git, the authors / committers are filled by resolve_commit_users_async
+    '''
+    repo_path = get_repo_path(ROOT_PATH, f"{user_name}/{proj_name}")
+    # the same date format as the API, e.g. 2020-01-01T00:00:00Z
+    args = ["log", "--format=" + GIT_LOG_FORMAT, "--date=format-local:%Y-%m-%dT%H:%M:%SZ"]
+    since = get_checkpoint_since(checkpoint)
+    known_shas = get_known_shas(checkpoint)
+    if since is not None:
+        args.append(f"--since={since}")
+    if CRAWL_UNTIL is not None:
+        args.append(f"--until={CRAWL_UNTIL}")
+    if MAX_COMMITS_PER_REPO is not None:
+        # more, the commits of last run within the window may be listed again
+        args.append(f"--max-count={MAX_COMMITS_PER_REPO + len(known_shas)}")
+    args.append("HEAD")
+    process = await asyncio.create_subprocess_exec("git", *args, cwd=repo_path, stdout=subprocess.PIPE,
+                                                   env={**os.environ, "TZ": "UTC"})
+    stdout, _ = await process.communicate()
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, ["git"] + args)
+
+    commits = []
+    for record in stdout.decode('utf-8', errors='replace').split("\x1e"):
+        record = record.lstrip("\n")
+        if record == "":
+            continue
+        sha, parents, date, author_email, committer_email, message = record.split("\x00")
+        if sha in known_shas: # crawled by the last run, within the window before the checkpoint
+            continue
+        commits.append({
+            "sha": sha,
+            "html_url": f"{GITHUB_URL}/{user_name}/{proj_name}/commit/{sha}",
+            "commit": {
+                "message": message.rstrip("\n"),
+                "committer": {"date": date}
+            },
+            "author": author_email, # replaced by the GitHub user
+            "committer": committer_email,
+            "parents": [{"sha": parent} for parent in parents.split()]
+        })
+        if MAX_COMMITS_PER_REPO is not None and len(commits) >= MAX_COMMITS_PER_REPO:
+            break
+    await resolve_commit_users_async(user_name, proj_name, commits)
+    return commits
+
+async def resolve_commit_users_async(user_name, proj_name, commits):
+    '''
+    Replace the author / committer emails of git log commits by their GitHub users. Each distinct email is resolved once,
+    by parse_noreply_email if possible, otherwise by asking GitHub about 1 commit using it, GRAPHQL_USERS_PER_QUERY emails per query
+    '''
+    samples = {} # unresolved email -> (sha of a commit using it, 'author' or 'committer')
+    for commit in commits:
+        for role in ['author', 'committer']:
+            email = commit[role]
+            if email in EMAIL_USERS or email in samples:
+                continue
+            user = parse_noreply_email(email)
+            if user is not None:
+                EMAIL_USERS[email] = user
+            else:
+                samples[email] = (commit['sha'], role)
+
+    async def resolve_batch(batch):
+        fields = " ".join(f'c{idx}: object(oid: {json.dumps(sha)}) {{ ... on Commit {{ {role} {{ user {{ login }} }} }} }}'
+                          for idx, (_, (sha, role)) in enumerate(batch))
+        query = f'query {{ r0: repository(owner: {json.dumps(user_name)}, name: {json.dumps(proj_name)}) {{ {fields} }} }}'
+        content, _ = await request_async(GRAPHQL_URL, json_body={"query": query})
+        repo_data = (json.loads(content).get('data') or {}).get('r0') or {}
+        for idx, (email, (_, role)) in enumerate(batch):
+            actor = (repo_data.get(f'c{idx}') or {}).get(role)
+            # GitActor.user is only set for real GitHub users, as in graphql_node_to_commit
+            EMAIL_USERS[email] = None if actor is None or actor['user'] is None else {"login": actor['user']['login'], "type": "User"}
+
+    samples = list(samples.items())
+    await asyncio.gather(*[resolve_batch(samples[i:i+GRAPHQL_USERS_PER_QUERY]) for i in range(0, len(samples), GRAPHQL_USERS_PER_QUERY)])
+    for commit in commits:
+        commit['author'] = EMAIL_USERS.get(commit['author'])
+        commit['committer'] = EMAIL_USERS.get(commit['committer'])
+
+def get_crawl_rules():
+    # the engine of the CRAWL_FILTER_RULES subset of commit_filter, None if no rule is applied while crawling
+    if len(CRAWL_FILTER_RULES) == 0:
+        return None
+    commit_rules = import_module("2_clean_commit_info").COMMIT_RULES
+    unknown = set(CRAWL_FILTER_RULES) - {'2', '3', '4', '7'}
+    if len(unknown) > 0:
+        raise ValueError(f"Rules {', '.join(sorted(unknown))} can not be applied while crawling, only 2, 3, 4 and 7")
+    return RuleEngine([Rule(rule.label, rule.description, rule.check) for rule in commit_rules.rules if rule.label in CRAWL_FILTER_RULES])
+
+async def crawl_commits_async(lang, repos_info):
+    '''
+    Crawl the commits of the given repos, at most MAX_CONCURRENT_REPOS repos (GraphQL batches) are crawled at the same time.
+    The commits of each repo are appended to {lang}_commit_info.jsonl as soon as the repo is done, followed by its checkpoint,
+    so a crash only loses the repos in progress. Return the number of new commits
+    '''
+    writer = CommitWriter(ROOT_PATH, lang, COMPRESS_COMMIT_INFO, KEEP_RAW_COMMIT_INFO, KEEP_CRAWL_REJECTS and len(CRAWL_FILTER_RULES) > 0)
+    seen = SeenCommits(get_seen_commits_path(ROOT_PATH)) if DEDUPE_COMMITS else None
+    crawl_rules = get_crawl_rules()
+    checkpoints = load_checkpoints(lang)
+    if checkpoints == {}: # no checkpoint, start a new commit file as the first run
+        writer.truncate()
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REPOS)
+    clone_semaphore = asyncio.Semaphore(MAX_CONCURRENT_CLONES) # git mode, each repo is cloned before its commits are read
+    if COMMIT_SOURCE == 'git':
+        os.makedirs(ROOT_PATH+'/repos', exist_ok=True)
+    pbar = tqdm(total=len(repos_info), desc='Get commit')
+    def record(title, commits):
+        checkpoint = checkpoints.get(title)
+        # duplicates and rejected commits are dropped before they are written, the checkpoint still moves to the newest crawled commit
+        unique_commits = seen.filter_commits(commits) if seen is not None else commits
+        kept_commits = []
+        rejects = []
+        for commit in unique_commits:
+            try:
+                if crawl_rules is not None:
+                    crawl_rules.apply(commit)
+                kept_commits.append(commit)
+            except ValueError as e:
+                label = str(e).split(' ')[0]
+                METRICS.inc("crawl_rejected_commits_total", rule=label)
+                rejects.append({"sha": commit['sha'], "html_url": commit['html_url'], "rule": label})
+        writer.write_all(kept_commits, unique_commits)
+        writer.write_rejects(rejects)
+        if len(commits) > 0:
+            checkpoints[title] = update_checkpoint(checkpoint, commits)
+            save_checkpoints(lang, checkpoints)
+
+    async def crawl_repo(idx, repo):
+        async with semaphore:
+            try:
+                title = repo["full_name"]
+                print(f'==> In repo {title}')
+                user_name, proj_name = re.match('(.+)/(.+)', title).groups()
+                if COMMIT_SOURCE == 'git':
+                    async with clone_semaphore:
+                        await git_clone_async(user_name, proj_name, repo.get("default_branch"), await get_fork_parent_async(repo))
+                    commits = await get_repo_commits_git_async(user_name, proj_name, checkpoints.get(title))
+                else:
+                    commits = await get_repo_commits_async(user_name, proj_name, checkpoints.get(title))
+                record(title, commits)
+                return len(commits)
+            except:
+                print(f'fail to get repo of idx {idx}')
+                return 0
+            finally:
+                pbar.update(1)
+
+    async def crawl_repo_batch(batch):
+        # GraphQL mode, the repos of a batch share each query
+        async with semaphore:
+            titles = [repo["full_name"] for _, repo in batch]
+            print(f'==> In repos {", ".join(titles)}')
+            try:
+                commits_by_repo = await get_repos_commits_graphql_async(titles, checkpoints)
+            except:
+                commits_by_repo = {title: None for title in titles}
+            new_commit_num = 0
+            for idx, repo in batch:
+                commits = commits_by_repo[repo["full_name"]]
+                if commits is None:
+                    print(f'fail to get repo of idx {idx}')
+                    continue
+                record(repo["full_name"], commits)
+                new_commit_num += len(commits)
+            pbar.update(len(batch))
+            return new_commit_num
+
+    try:
+        if COMMIT_SOURCE == 'graphql':
+            indexed_repos = list(enumerate(repos_info))
+            batches = [indexed_repos[i:i+GRAPHQL_REPOS_PER_QUERY] for i in range(0, len(indexed_repos), GRAPHQL_REPOS_PER_QUERY)]
+            new_commit_nums = await asyncio.gather(*[crawl_repo_batch(batch) for batch in batches])
+        else:
+            new_commit_nums = await asyncio.gather(*[crawl_repo(idx, repo) for idx, repo in enumerate(repos_info)])
+    finally:
+        pbar.close()
+        if seen is not None:
+            seen.close()
+    return sum(new_commit_nums)
+
+async def run_git_async(args, cwd):
+    process = await asyncio.create_subprocess_exec("git", *args, cwd=cwd)
+    if await process.wait() != 0:
+        raise subprocess.CalledProcessError(process.returncode, ["git"] + args)
+
+async def get_local_head_branch_async(repo_path):
+    # resolve the default branch from the local origin/HEAD ref, instead of asking the remote by `git remote show origin`
+    process = await asyncio.create_subprocess_exec("git", "symbolic-ref", "--short", "refs/remotes/origin/HEAD",
+                                                   cwd=repo_path, stdout=subprocess.PIPE)
+    stdout, _ = await process.communicate()
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, "git symbolic-ref --short refs/remotes/origin/HEAD")
+    return stdout.decode().strip().split('/', 1)[1] # origin/main -> main
+
+async def protect_reference_async(reference_path):
+    '''
+    A repo whose objects are borrowed by objects/info/alternates must never prune them: a gc after `fetch --prune` would
+    delete the objects of the dropped branches, which its borrowers still use. Disable pruning in the repo,
+    return False if its config can not be written (e.g. a read only mirror store)
+    '''
+    try:
+        await run_git_async(["config", "gc.pruneExpire", "never"], reference_path)
+        return True
+    except subprocess.CalledProcessError:
+        return False
+
+async def git_clone_async(user_name, proj_name, default_branch=None, reference=None):
+    '''
+    Clone the repo to {ROOT_PATH}/repos/{user_name}/{proj_name}, or fetch the new commits if it has been cloned.
+    The repo is seeded from REPO_MIRROR_DIR / REPO_BUNDLE_DIR if it is there, then fetched from GitHub unless OFFLINE.
+    reference: the full name of a related repo (e.g. the parent of a fork), its local objects are borrowed if it has been cloned.
+    A mirror / reference objects are borrowed from gets gc.pruneExpire=never (check protect_reference_async),
+    if that fails the borrowed objects are copied into the clone (--dissociate).
+    default_branch comes from the repo information, if not given, it is resolved from the local refs.
+    Clones of the old layout must have been moved by repo_store.migrate_legacy_repos
+    '''
+    full_name = f"{user_name}/{proj_name}"
+    repo_path = os.path.normpath(os.path.join(ROOT_PATH, 'repos', full_name))
+    if get_config_path(os.path.dirname(repo_path)) is not None: # the owner directory is a clone of the old layout
+        raise Exception(f"==> Downloading {full_name} failed, migrate the clone of the old layout {os.path.dirname(repo_path)} first")
+    github_url = urlparse(GITHUB_URL)
+    clone_url = f"{github_url.scheme}://{await asyncio.to_thread(SCHEDULER.peek)}@{github_url.netloc}/{full_name}.git"
+    start = time.time()
+    operation = "fetch" if os.path.exists(repo_path+'/') else "clone"
+    if operation == "clone":
+        os.makedirs(os.path.dirname(repo_path), exist_ok=True)
+        seed_source = get_seed_source(full_name, REPO_MIRROR_DIR, REPO_BUNDLE_DIR)
+        if seed_source is None and OFFLINE:
+            raise Exception(f"==> Downloading {full_name} failed, offline mode and no local mirror / bundle")
         try:
-            fetch_command = ["git", "fetch", "origin"]
-            subprocess.run(fetch_command, check=True, cwd=os.path.normpath(ROOT_PATH+'/repos/'+proj_name))
-            # Run the Git pull command
-            reset_command = ["git", "reset", "--hard", f"origin/{branch_name}"]
-            subprocess.run(reset_command, check=True, cwd=os.path.normpath(ROOT_PATH+'/repos/'+proj_name))
+            if seed_source is not None: # no network, the remote is pointed to GitHub afterwards
+                operation = "seed"
+                share = []
+                if SHARE_MIRROR_OBJECTS and not seed_source.endswith('.bundle'):
+                    share = ["--shared"] if await protect_reference_async(seed_source) else ["--shared", "--dissociate"]
+                await run_git_async(["clone", "--quiet"] + share + CLONE_OPTIONS[CLONE_MODE] + [seed_source, repo_path], os.path.dirname(repo_path))
+                await run_git_async(["remote", "set-url", "origin", clone_url], repo_path)
+            else: # if not, download the whole repo of the latest version
+                reference_path = get_repo_path(ROOT_PATH, reference) if reference is not None else None
+                # objects found in the related repo are not downloaded again, they are shared by objects/info/alternates
+                share = []
+                if reference_path is not None and os.path.exists(reference_path):
+                    share = ["--reference-if-able", reference_path]
+                    if not await protect_reference_async(reference_path):
+                        share.append("--dissociate")
+                git_clone_command = ["clone", "--quiet"] + share + CLONE_OPTIONS[CLONE_MODE] + [clone_url, repo_path]
+                await run_git_async(git_clone_command, os.path.dirname(repo_path))
         except:
-            raise Exception(f"==> Pulling {user_name}/{proj_name} failed")
-    else: # if not, download the whole repo of the latest version
-        clone_url = f"https://{GITHUB_TOKENS[CURR_TOKEN_IDX]}@github.com/{user_name}/{proj_name}.git"
+            METRICS.observe("git_clone_seconds", time.time() - start, buckets=DURATION_BUCKETS, operation=operation, result="fail")
+            raise Exception(f"==> Downloading {full_name} failed")
+    if operation != "clone" and not OFFLINE: # fetch the commits newer than the local copy
         try:
-            git_clone_command = ["git", "clone", clone_url]
-            # Run the Git clone command
-            subprocess.run(git_clone_command, check=True, cwd=os.path.normpath(ROOT_PATH+'/repos'))
+            await run_git_async(["fetch", "--quiet", "--prune", "origin"], repo_path)
+            if os.path.exists(os.path.join(repo_path, '.git')): # bare mirrors have no work tree to reset
+                if default_branch is None:
+                    default_branch = await get_local_head_branch_async(repo_path)
+                await run_git_async(["reset", "--quiet", "--hard", f"origin/{default_branch}"], repo_path)
         except:
-            raise Exception(f"==> Downloading {user_name}/{proj_name} from {clone_url} failed")
-    
+            METRICS.observe("git_clone_seconds", time.time() - start, buckets=DURATION_BUCKETS, operation=operation, result="fail")
+            raise Exception(f"==> Pulling {full_name} failed")
+    METRICS.observe("git_clone_seconds", time.time() - start, buckets=DURATION_BUCKETS, operation=operation, result="ok")
+
+def git_clone(user_name, proj_name, default_branch=None, reference=None):
+    # sync wrapper of git_clone_async
+    return CLIENT.run(git_clone_async(user_name, proj_name, default_branch, reference))
+
+async def get_fork_parent_async(repo):
+    '''
+    The full name of the repo a fork is forked from, None if it is not a fork (or the parent can not be requested).
+    The search API the repo information comes from does not tell it, the repos API is asked for each fork.
+    Forks are only crawled if SKIP_FORKS is False, otherwise only a mirror seed (REPO_MIRROR_DIR) shares objects
+    '''
+    if not repo.get("fork"):
+        return None
+    parent = repo.get("parent") or repo.get("source")
+    if parent is None:
+        try:
+            parent = json.loads(await get_response_async(f"{GITHUB_API_URL}/repos/{repo['full_name']}")).get("parent")
+        except Exception: # e.g. offline and not cached, clone without a reference
+            return None
+    return parent["full_name"] if parent is not None else None
+
+async def clone_repos_async(repos_info):
+    # clone / fetch at most MAX_CONCURRENT_CLONES repos at the same time, a fork waits for its parent if it is cloned as well
+    os.makedirs(ROOT_PATH+'/repos', exist_ok=True)
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_CLONES)
+    cloned = {repo["full_name"]: asyncio.Event() for repo in repos_info} # set once the repo is cloned / failed
+    pbar = tqdm(total=len(repos_info), desc='Git clone repos')
+    async def clone_repo(repo):
+        try:
+            parent = await get_fork_parent_async(repo)
+            if parent in cloned: # wait outside the semaphore, so the parent can take a slot
+                await cloned[parent].wait()
+            async with semaphore:
+                user_name, proj_name = re.match('(.+)/(.+)', repo["full_name"]).groups()
+                await git_clone_async(user_name, proj_name, repo.get("default_branch"), parent)
+        except Exception as e:
+            print(e)
+        finally:
+            cloned[repo["full_name"]].set()
+            pbar.update(1)
+    try:
+        await asyncio.gather(*[clone_repo(repo) for repo in repos_info])
+    finally:
+        pbar.close()
+
+def load_qualification(lang):
+    qualification_path = os.path.join(ROOT_PATH, 'repo_info', f'{lang}_qualification.json')
+    if not os.path.exists(qualification_path):
+        return {}
+    with open(qualification_path, 'r') as f:
+        return json.load(f)
+
+def save_qualification(lang, qualification):
+    qualification_path = os.path.join(ROOT_PATH, 'repo_info', f'{lang}_qualification.json')
+    with open(qualification_path + '.tmp', 'w') as f:
+        json.dump(qualification, f, indent=4)
+    os.replace(qualification_path + '.tmp', qualification_path)
+
+async def qualify_repo_async(title, candidate_urls):
+    '''
+    Estimate the yield of 1 repo from a sample of its candidate commits, return its qualification record
+    '''
+    sample = random.Random(title).sample(candidate_urls, min(QUALIFY_SAMPLE_SIZE, len(candidate_urls)))
+    async def check(commit_url):
+        sha = commit_url.split('/')[-1]
+        content = await get_response_async(f"{GITHUB_API_URL}/repos/{title}/commits/{sha}")
+        try:
+            check_commit_files(json.loads(content).get('files', []))
+            return 1
+        except ValueError:
+            return 0
+    passed_num = sum(await asyncio.gather(*[check(commit_url) for commit_url in sample]))
+    estimated_yield = estimate_yield(len(candidate_urls), len(sample), passed_num)
+    return {
+        "candidates": len(candidate_urls),
+        "sampled": len(sample),
+        "passed": passed_num,
+        "estimated_yield": estimated_yield,
+        "qualified": estimated_yield >= QUALIFY_MIN_YIELD
+    }
+
+async def qualify_repos_async(lang, repos_info):
+    '''
+    Return the repos worth cloning, the candidate commits are the crawled commits passing 2_clean_commit_info.commit_filter.
+    Repos cloned before are always kept. The record of each repo is saved to {ROOT_PATH}/repo_info/{lang}_qualification.json,
+    and reused while its number of candidates is unchanged, so deferred repos can be cloned later by lowering QUALIFY_MIN_YIELD
+    '''
+    commit_filter = import_module("2_clean_commit_info").commit_filter
+    candidate_urls = {repo["full_name"]: [] for repo in repos_info
+                      if not os.path.exists(get_repo_path(ROOT_PATH, repo["full_name"]))}
+    store = open_commit_store(ROOT_PATH, lang)
+    for commit in store.iter_commits():
+        title = get_full_name(commit['html_url'])
+        if title not in candidate_urls:
+            continue
+        try:
+            commit_filter(commit)
+            candidate_urls[title].append(commit['html_url'])
+        except ValueError:
+            pass
+    store.close()
+
+    qualification = load_qualification(lang)
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REPOS)
+    async def qualify(title):
+        record = qualification.get(title)
+        if record is not None and record["candidates"] == len(candidate_urls[title]):
+            return
+        async with semaphore:
+            try:
+                qualification[title] = await qualify_repo_async(title, candidate_urls[title])
+            except Exception as e: # can not be estimated, clone it as before
+                print(f'==> Fail to qualify repo {title}: {e}')
+    await asyncio.gather(*[qualify(title) for title in candidate_urls])
+    save_qualification(lang, qualification)
+
+    qualified = [repo for repo in repos_info if repo["full_name"] not in candidate_urls
+                 or qualification.get(repo["full_name"], {"qualified": True})["qualified"]]
+    print(f'==> {len(qualified)} of {len(repos_info)} repos qualified, the others are deferred, check {lang}_qualification.json')
+    return qualified
+
+async def crawl_commits_and_clone_async(lang, repos_info):
+    if COMMIT_SOURCE == 'git': # the commits are read from the clones, crawl_commits_async clones the repos itself
+        return await crawl_commits_async(lang, repos_info)
+    if QUALIFY_REPOS: # the commits are needed to qualify the repos, clone after crawling
+        new_commit_num = await crawl_commits_async(lang, repos_info)
+        await clone_repos_async(await qualify_repos_async(lang, repos_info))
+        return new_commit_num
+    # cloning only needs the repo information, it runs together with the commit crawling
+    new_commit_num, _ = await asyncio.gather(crawl_commits_async(lang, repos_info), clone_repos_async(repos_info))
+    return new_commit_num
+
 def crawl(lang, repo_num):
     global ROOT_PATH
     # ---------------------- Get the top star repo's name ----------------------
     if not os.path.exists(ROOT_PATH+"/repo_info"):
         os.mkdir(ROOT_PATH+"/repo_info")
     print("==> Starting to get repos of %s ..." % lang)
-    if os.path.exists(ROOT_PATH+f"/repo_info/{lang}_top_star_repos.jsonl"):    # if have recorded repos before
-        # open recorded repo info
-        with jsonlines.open(ROOT_PATH+f"/repo_info/{lang}_top_star_repos.jsonl") as reader:
-            print(f"==> {lang}_top_star_repos.jsonl exists, read from local")
-            repos = list(reader)
-        if len(repos) < repo_num: # if the number of repo has not been satisfied
-            repos = get_repos(lang, repo_num) # get the desired number of repos
-            # save repo info
-            with jsonlines.open(ROOT_PATH+f"/repo_info/{lang}_top_star_repos.jsonl", 'w') as writer:
-                writer.write_all(repos)
-    else:
-        repos = get_repos(lang, repo_num) # get the desired number of repos
-        # save repo info
-        with jsonlines.open(ROOT_PATH+f"/repo_info/{lang}_top_star_repos.jsonl", 'w') as writer:
-            writer.write_all(repos)
+    repos = update_repos(lang, repo_num)
     print(f"==> Get {str(len(repos[:repo_num]))} repos of {lang}")
 
     with open(os.path.join(ROOT_PATH, 'repo_info', f'{lang}_top_star_repos.jsonl')) as f:
         repos_info = ([json.loads(line) for line in f.readlines()])
 
-    commit_d = []
-    for idx, repo in enumerate(tqdm(repos_info[:repo_num], desc='Get commit')):
-        try:
-            title = repo["full_name"]
-            print(f'==> In repo {title}')
-            user_name, proj_name = re.match('(.+)/(.+)', title).groups()
-            commit_d.extend(get_all_response(f"https://api.github.com/repos/{user_name}/{proj_name}/commits"))
-        except:
-            print(f'fail to get repo of idx {idx}')
-    print(f'{lang} have {len(commit_d)} commits')
+    repos_info = repos_info[:repo_num]
+    # before any clone of the new layout repos/{owner}/{name}, an owner directory may have the name of an old clone
+    migrated_num = migrate_legacy_repos(ROOT_PATH)
+    if migrated_num > 0:
+        print(f"==> Moved {migrated_num} clones of the old layout repos/{{name}} to repos/{{owner}}/{{name}}")
+    if SKIP_FORKS:
+        forks = [repo["full_name"] for repo in repos_info if is_fork_or_mirror(repo)]
+        if len(forks) > 0:
+            print(f"==> Skip {len(forks)} forks / mirrors: {', '.join(forks)}")
+        repos_info = [repo for repo in repos_info if not is_fork_or_mirror(repo)]
+
     if not os.path.exists(os.path.join(ROOT_PATH, 'commit_info')):
         os.mkdir(os.path.join(ROOT_PATH, 'commit_info'))     
-    with jsonlines.open(os.path.join(ROOT_PATH,f"commit_info/{lang}_commit_info.jsonl"), 'w') as writer:
-        writer.write_all(commit_d)
-    
-    for repo in tqdm(repos_info[:repo_num], desc='Git clone repos'):
-        title = repo["full_name"]
-        user_name, proj_name = re.match('(.+)/(.+)', title).groups()
-        git_clone(user_name, proj_name)
-        
+    new_commit_num = CLIENT.run(crawl_commits_and_clone_async(lang, repos_info))
+    print(f'{lang} have {new_commit_num} new commits')
+    METRICS.inc("crawl_new_commits_total", new_commit_num, lang=lang)
+    METRICS.stop_flush()
+    METRICS.flush(METRICS_JSON_PATH, METRICS_PROMETHEUS_PATH)
+    print(METRICS.summary())
+    if PROXY_POOL is not None:
+        PROXY_POOL.stop_refresh()
+    CLIENT.close()
+
 if __name__ == '__main__':
     start = time.time()
     lang = 'python' # java, python, typescript, go
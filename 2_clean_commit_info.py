@@ -1,10 +1,22 @@
 # This script is used to filter the commit based on the commit information, check function commit_filter
 # The url of commits that pass the cleaning are stored in {ROOT_PATH}/commit_info/{lang}_filtered_commit_urls.json
+# Verdicts of the rules are cached by commit sha and rule definition (check verdict_cache.py), a rerun after changing
+# a rule only evaluates the changed rule, on the commits no unchanged rule rejects
+# Rule 8: a commit whose sha is claimed by another repo / language (check seen_commits.py), rule 15 of 3_clean_edit_info
 import re
 import os
 import json
 from tqdm import tqdm
+from collections import deque
+from multiprocessing import Pool
+from commit_store import COLUMNS, open_commit_store, row_to_commit
+from seen_commits import DUPLICATE_DESCRIPTION, SeenCommits, get_seen_commits_path
+from rule_engine import Rule, RuleEngine
+from verdict_cache import VerdictCache, get_verdict_cache_path
 ROOT_PATH = '/media/chenyan'
+NUM_WORKERS = os.cpu_count() # processes filtering the commits, 1 to filter in this process
+CHUNK_SIZE = 10000 # the number of commits sent to a worker at once
+CACHE_VERDICTS = True # reuse the rule verdicts of previous runs, False to evaluate every rule on every commit
     
 def remove_pull_id(commit_message):
     # 定义匹配 pull request ID 的正则表达式
@@ -15,103 +27,171 @@ def remove_pull_id(commit_message):
 
     return updated_message
 
+# compiled once, not once per commit
+IMPERATIVE_PATTERN = re.compile(r'\b(?:fix|add|change|update|remove|refactor|improve|make|start|stop|debug|test|ensure|delete|merge|move|rename|clean|correct|allow|avoid|implement|complete|revert|set|increase|decrease|optimize|docs)\b', re.IGNORECASE)
+FILE_NAME_PATTERN = re.compile(r'([^/.]+\.\w+)')
+EXTERNAL_REFERENCE_PATTERN = re.compile(r"(https?:\/\/(?:www\.|(?!www))[a-zA-Z0-9][a-zA-Z0-9-]+[a-zA-Z0-9]\.[^\s]{2,}|www\.[a-zA-Z0-9][a-zA-Z0-9-]+[a-zA-Z0-9]\.[^\s]{2,}|https?:\/\/(?:www\.|(?!www))[a-zA-Z0-9]+\.[^\s]{2,}|www\.[a-zA-Z0-9]+\.[^\s]{2,})")
+
+def is_single_intent(commit_dict):
+    # should at least have imperative mood, and only 1 kind of it
+    matches = IMPERATIVE_PATTERN.findall(commit_dict['commit']['message'])
+    return len(set(matches)) == 1
+
+def is_ascii(commit_dict):
+    return commit_dict['commit']['message'].isascii()
+
+def has_proper_length(commit_dict):
+    num_words = len(commit_dict['commit']['message'].split(" "))
+    return 8 <= num_words <= 128
+
+def is_by_user(commit_dict):
+    author = commit_dict.get('author')
+    committer = commit_dict.get('committer')
+    return author is not None and committer is not None and author.get('type') == 'User' and committer.get('type') == 'User'
+
+def has_no_file_name(commit_dict):
+    return FILE_NAME_PATTERN.search(commit_dict['commit']['message']) is None
+
+def has_no_external_reference(commit_dict):
+    return EXTERNAL_REFERENCE_PATTERN.search(commit_dict['commit']['message']) is None
+
+def is_not_merge(commit_dict):
+    commit_msg = commit_dict['commit']['message']
+    return "Merge pull request" not in commit_msg and "Merge branch" not in commit_msg
+
+# the rules of commit_filter, the cheap ones first, reordered by their measured cost and rejection rate
+COMMIT_RULES = RuleEngine([
+    Rule('2', 'Commit msg contain non-ascii char', is_ascii),
+    Rule('3', 'Commit msg contain < 8 words or > 128 words', has_proper_length),
+    Rule('4', 'Commit author / committer not real user', is_by_user),
+    Rule('7', 'Merge pull request / branch commit', is_not_merge),
+    Rule('1', 'Commit msg contain > 1 edit intention', is_single_intent),
+    Rule('5', 'Commit msg contain file name', has_no_file_name),
+    Rule('6', 'Commit msg contain external reference', has_no_external_reference)
+])
+
 def commit_filter(commit_dict):
-    def count_file_names(input_string):
-        file_name_pattern = r'([^/.]+\.\w+)'
-        matches = re.findall(file_name_pattern, input_string)
-        return len(matches)
-    
-    def count_external_references(input_string):
-        reference_pattern = r"(https?:\/\/(?:www\.|(?!www))[a-zA-Z0-9][a-zA-Z0-9-]+[a-zA-Z0-9]\.[^\s]{2,}|www\.[a-zA-Z0-9][a-zA-Z0-9-]+[a-zA-Z0-9]\.[^\s]{2,}|https?:\/\/(?:www\.|(?!www))[a-zA-Z0-9]+\.[^\s]{2,}|www\.[a-zA-Z0-9]+\.[^\s]{2,})"
-        matches = re.findall(reference_pattern, input_string)
-        return len(matches)
-    
-    def detect_multiple_edit_intent(msg):
-        # should at least have imperative mood
-        imperative_regex = re.compile(r'\b(?:fix|add|change|update|remove|refactor|improve|make|start|stop|debug|test|ensure|delete|merge|move|rename|clean|correct|allow|avoid|implement|complete|revert|set|increase|decrease|optimize|docs)\b', re.IGNORECASE)
-        matches = imperative_regex.findall(msg)
-        if len(matches) == 0:
-            return False
-        title = msg.split("\n")[0]
-        body = "\n".join(msg.split("\n")[1:])
-
-        # when body is empty
-        if body.strip() == "":
-            target = title
-        else:
-            target = body
-
-        matches = imperative_regex.findall(msg)
-        if len(set(matches)) == 1:
-            return True
-        else:
-            return False
-    
-    commit_msg = commit_dict['commit']['message']  
-    # 1. return False if commit message contain multiple edit intents
-    single_intent = detect_multiple_edit_intent(commit_msg)
-    if not single_intent:
-        raise ValueError('1 Commit msg contain > 1 edit intention')
-    
-    # 2. return False if commit message is not in English
-    if not commit_msg.isascii():
-        raise ValueError('2 Commit msg contain non-ascii char')
-    
-    # 3. return False if commit message contain < 8 or > 128 words
-    num_words = len(commit_msg.split(" "))
-    if num_words < 8 or num_words > 128:
-        raise ValueError('3 Commit msg contain < 8 words or > 128 words')
-    # commit_msg_lines = commit_msg.split("\n")
-    # if len(commit_msg_lines) < 3 or len(commit_msg_lines) > 5:
-    #     return False
-    
-    # 4. return False if author or committer is not a User
-    try:
-        author_type = commit_dict['author']['type']
-        committer_type = commit_dict['committer']['type']
-        assert author_type == 'User' and committer_type == 'User'
-    except:
-        raise ValueError('4 Commit author / committer not real user')
-    
-    # 5. return False if commit message contain file names
-    num_file_names = count_file_names(commit_msg)
-    if num_file_names > 0:
-        raise ValueError('5 Commit msg contain file name')
-    
-    # 6. return False if commit message contain external references
-    num_external_references = count_external_references(commit_msg)
-    if num_external_references > 0:
-        raise ValueError('6 Commit msg contain external reference')
-    
-    # 7. return False if commit merge pull request, merge branch
-    if "Merge pull request" in commit_msg or "Merge branch" in commit_msg:
-        raise ValueError('7 Merge pull request / branch commit')
-    
-    return True
+    # raise ValueError('{rule label} {description}') at the first rule the commit fails
+    return COMMIT_RULES.apply(commit_dict)
+
+def filter_commit_rows(rows, cached_verdicts=None):
+    '''
+    Worker: filter a chunk of commit store rows, return ([(sha, html_url, error or None if passed)], new verdicts, rule stats)
+    cached_verdicts: {sha: {rule hash: passed}} of these commits, None to not use the cache.
+    New verdicts are [(sha, rule hash, passed)] of the rules evaluated
+    '''
+    results = []
+    new_verdicts = []
+    for row in rows:
+        commit = row_to_commit(row)
+        verdicts = None if cached_verdicts is None else dict(cached_verdicts.get(commit['sha'], {}))
+        try:
+            COMMIT_RULES.apply(commit, verdicts)
+            results.append((commit['sha'], commit['html_url'], None))
+        except Exception as e:
+            results.append((commit['sha'], commit['html_url'], str(e)))
+        if verdicts is not None:
+            cached = cached_verdicts.get(commit['sha'], {})
+            new_verdicts += [(commit['sha'], rule_hash, passed) for rule_hash, passed in verdicts.items() if rule_hash not in cached]
+    return results, new_verdicts, COMMIT_RULES.pop_stats()
+
+def iter_chunks(rows, chunk_size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
 
 def clean_commit(lang):
+    '''
+    Chunks of the commit store are filtered by NUM_WORKERS processes, at most 2 chunks per worker are in flight,
+    the results are handled in the order of the commit info, so memory stays flat and the output is in order
+    '''
     global ROOT_PATH
-    with open(os.path.join(ROOT_PATH,f"commit_info/{lang}_commit_info.jsonl"), "r") as f:
-        commit_set = [json.loads(line) for line in f.readlines()]
+    COMMIT_RULES.pop_stats() # only count this run
     error_cnt = {}
-    filtered_commit_urls = []
-    for commit in tqdm(commit_set):
-        try:
-            commit_filter(commit)
-            filtered_commit_urls.append(commit["html_url"])
-        except Exception as e:
-            label = str(e).split(' ')[0]
-            if label not in ['1', '2', '3', '4', '5', '6', '7']:
-                print('Unexpected Error:', e)
-                print('Commit url:', commit['html_url'])
-                break
+    filtered_commit_num = 0
+    commit_num = 0
+    # commit info crawled before the seen-set existed may still contain duplicates
+    seen = SeenCommits(get_seen_commits_path(ROOT_PATH))
+    output_path = os.path.join(ROOT_PATH, f'commit_info/{lang}_filtered_commit_urls.json')
+    # written incrementally in the format of json.dump(urls, f, indent=4), replaces the old file once complete
+    f = open(output_path + '.tmp', 'w')
+    f.write('[')
+    pbar = tqdm()
+
+    def handle(results, new_verdicts, rule_stats):
+        # return False at an unexpected error
+        nonlocal filtered_commit_num, commit_num
+        COMMIT_RULES.merge_stats(rule_stats)
+        if cache is not None:
+            cache.put(new_verdicts)
+        for sha, html_url, error in results:
+            commit_num += 1
+            pbar.update(1)
+            # the duplicate check goes first, as claims must be made in the order of the commit info
+            if not seen.claim(sha, html_url):
+                error = f'8 {DUPLICATE_DESCRIPTION}'
+            if error is None:
+                f.write((',\n    ' if filtered_commit_num > 0 else '\n    ') + json.dumps(html_url))
+                filtered_commit_num += 1
+                continue
+            label = error.split(' ')[0]
+            if label not in ['1', '2', '3', '4', '5', '6', '7', '8']:
+                print('Unexpected Error:', error)
+                print('Commit url:', html_url)
+                return False
             else:
                 if label not in error_cnt:
                     error_cnt[label] = 1
                 else:
                     error_cnt[label] += 1
+        return True
+
+    cache = None
+    rule_hashes = [rule.hash for rule in COMMIT_RULES.rules]
+    if CACHE_VERDICTS:
+        cache = VerdictCache(get_verdict_cache_path(ROOT_PATH))
+        pruned_verdict_num = cache.prune(rule_hashes)
+        if pruned_verdict_num > 0:
+            print(f'==> Pruned {pruned_verdict_num} cached verdicts of changed rules')
+
+    def get_task(chunk):
+        # the chunk and its cached verdicts, read in this process so workers never touch the cache
+        if cache is None:
+            return (chunk, None)
+        return (chunk, cache.get([row[COLUMNS.index('sha')] for row in chunk], rule_hashes))
+
+    store = open_commit_store(ROOT_PATH, lang)
+    chunks = iter_chunks(store.iter_rows(), CHUNK_SIZE)
+    if NUM_WORKERS <= 1:
+        for chunk in chunks:
+            if not handle(*filter_commit_rows(*get_task(chunk))):
+                break
+    else:
+        with Pool(NUM_WORKERS) as pool:
+            pending = deque()
+            for chunk in chunks:
+                pending.append(pool.apply_async(filter_commit_rows, get_task(chunk)))
+                if len(pending) >= 2 * NUM_WORKERS and not handle(*pending.popleft().get()):
+                    pending.clear()
+                    break
+            while len(pending) > 0:
+                if not handle(*pending.popleft().get()):
+                    break
+    pbar.close()
+    store.close()
+    seen.close()
+    if cache is not None:
+        cache.close()
+    f.write('\n]' if filtered_commit_num > 0 else ']')
+    f.close()
+    os.replace(output_path + '.tmp', output_path)
                     
-    print(f'{lang} have {len(filtered_commit_urls)} left, survive rate: {len(filtered_commit_urls)/len(commit_set)*100:.2f}%')
+    print(f'{lang} have {filtered_commit_num} left, survive rate: {filtered_commit_num/commit_num*100:.2f}%')
     print('Commit filtered out because:')
     error_dict = {
         "1": "Commit msg contain > 1 edit intention",
@@ -120,13 +200,12 @@ def clean_commit(lang):
         "4": "Commit author / committer not real user",
         "5": "Commit msg contain file name",
         "6": "Commit msg contain external reference",
-        "7": "Merge pull request / branch commit"
+        "7": "Merge pull request / branch commit",
+        "8": DUPLICATE_DESCRIPTION # rule 15 of 3_clean_edit_info
     }
     for error_idx, error_num in error_cnt.items():
         print(f'Rule {error_idx} {error_dict[error_idx]}: {error_num}')
-
-    with open(os.path.join(ROOT_PATH, f'commit_info/{lang}_filtered_commit_urls.json'), 'w') as f:
-        json.dump(filtered_commit_urls, f, indent=4)
+    print(COMMIT_RULES.summary())
     
 if __name__ == '__main__':
     lang = 'python'
@@ -1,12 +1,29 @@
 # This script is used to 1. filter commit based on edits made, filter rules may check comments start with Rule #num
+# The diff of a commit comes from DIFF_BACKEND: 'log' streams the diffs of all commits of a repo from 1 `git log -p`,
+# 'git' forks `git diff` per commit
+# Commits are filtered by NUM_WORKERS processes, 1 task = up to SHARD_SIZE commits of 1 repo. Each commit has a time budget
+# (TIME_BUDGET seconds to get its diff, a budget scaled by the diff size to parse it), enforced inside the workers
+# Rule 15: a commit whose sha is claimed by another repo / language (check seen_commits.py), rule 8 of 2_clean_commit_info
 import re
 import os
 import json
 import signal
+import threading
 import subprocess
 from tqdm import tqdm
+from contextlib import contextmanager
+from multiprocessing import Pool
 from code_ast import *
+from seen_commits import DUPLICATE_DESCRIPTION, SeenCommits, get_seen_commits_path
+from repo_store import get_full_name, get_repo_path
 ROOT_PATH = '/media/chenyan'
+DIFF_BACKEND = 'log' # 'log' or 'git'
+DIFF_CONTEXT = 1000 # lines of context, large enough that a file has only 1 hunk
+NUM_WORKERS = os.cpu_count() # processes filtering the commits, 1 to filter in this process
+SHARD_SIZE = 1000 # commits of a repo per task, a large repo is split over several workers
+TIME_BUDGET = 10 # seconds to get the diff of a commit, and to parse a diff of up to TIME_BUDGET_LINES lines
+TIME_BUDGET_LINES = 2000 # a larger diff gets a proportionally larger budget to parse
+MAX_TIME_BUDGET = 60
 
 def contains_tag(main_string):
     """
@@ -33,25 +50,30 @@ def contains_tag(main_string):
     return any(substring.lower() in main_string_lower for substring in substrings)
 
 # 超时处理函数，定制化错误信息
-def timeout_handler(signum, frame, commit_url):
-    raise ValueError(f"14 {commit_url} Error: runtime exceeded 10 seconds")
+def timeout_handler(signum, frame, commit_url, seconds):
+    raise ValueError(f"14 {commit_url} Error: runtime exceeded {seconds:.0f} seconds")
 
-# 装饰器，用于给函数添加超时中断功能，并传递 commit_url
-def timeout(seconds):
-    def decorator(func):
-        def wrapper(*args, **kwargs):
-            # 提取 commit_url 从函数参数中，假设它是位置参数中的第一个
-            commit_url = args[0] if args else kwargs.get('commit_url', 'unknown')
-            # 设置信号处理函数，并传递 commit_url 作为额外参数
-            signal.signal(signal.SIGALRM, lambda signum, frame: timeout_handler(signum, frame, commit_url))
-            signal.alarm(seconds)  # 设置定时器，单位是秒
-            try:
-                result = func(*args, **kwargs)
-            finally:
-                signal.alarm(0)  # 取消定时器
-            return result
-        return wrapper
-    return decorator
+@contextmanager
+def timeout(commit_url, seconds):
+    '''
+    Raise rule 14 in the block once it runs for seconds, by SIGALRM, which works in the main thread of any process,
+    so in the workers of clean_edit as well. A git child waited for at that time is killed by its caller
+    (subprocess.run, iter_log_diffs)
+    '''
+    if threading.current_thread() is not threading.main_thread(): # no signal here, so no time limit
+        yield
+        return
+    previous_handler = signal.signal(signal.SIGALRM, lambda signum, frame: timeout_handler(signum, frame, commit_url, seconds))
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous_handler)
+
+def get_time_budget(diff_line_num):
+    # seconds to parse a diff of diff_line_num lines
+    return min(MAX_TIME_BUDGET, TIME_BUDGET * max(1, diff_line_num / TIME_BUDGET_LINES))
 
 def detect_extension(file_names: list[str]):
     # 使用os.path.basename获取文件名
@@ -151,30 +173,149 @@ def finer_grain_snapshot(snapshot: list, lang: str):
     
     return finer_grain_snapshot, edits
 
-@timeout(10)
-def git_parse_diff(commit_url: str, lang: str, strict: bool=True):
-    global ROOT_PATH
-    proj_name = commit_url.split('/')[-3]
-    repo_path = os.path.join(ROOT_PATH, 'repos',proj_name)
-    sha = commit_url.split('/')[-1]
-    
-    result_dict = {}
-    # 1. get git diff 
-    command = f'git -C {repo_path} diff -U1000 {sha}^ {sha}'
+def git_diff_sections(commit_url: str, repo_path: str, sha: str):
+    '''
+    Return [(before file name, after file name, diff content after the @@ line or None)] of a commit by `git diff`,
+    the file names are None if they fail to match (e.g. quoted non-ascii names)
+    '''
+    command = f'git -C {repo_path} diff -U{DIFF_CONTEXT} {sha}^ {sha}'
     try:
         result = subprocess.run(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-    except:
+    except (OSError, UnicodeDecodeError): # a timeout goes on as rule 14
         raise ValueError(f'1 {commit_url} Error: Error in git diff')
-    git_diff_str = result.stdout
+    return split_diff_sections(commit_url, result.stdout)
+
+def split_diff_sections(commit_url: str, git_diff_str: str):
+    # the sections of git_diff_sections, from the text of git diff
     if git_diff_str.strip() == '':
         raise ValueError(f'1 {commit_url} Error: Error in git diff')
     
+    # 1 section = 1 file
+    sections = []
+    for section in re.findall(r'diff --git[^\n]*\n.*?(?=\ndiff --git|$)', git_diff_str, re.DOTALL):
+        file_name_match = re.match(r'diff --git a/(.+) b/(.+)', section)
+        # (if -U{number} is set large enough, a file should contain only 1 @@ -xx,xx +xx,xx @@)
+        match = re.search(r'@@[^\n]*\n(.+)', section, re.DOTALL)
+        sections.append((file_name_match.group(1) if file_name_match else None,
+                         file_name_match.group(2) if file_name_match else None,
+                         match.group(1) if match else None))
+    return sections
+
+def iter_log_diffs(repo_path: str, shas: list[str]):
+    '''
+    Yield (sha, text of `git diff -U{DIFF_CONTEXT} sha^ sha` or None if it fails) of the commits of a repo, in any order.
+    All diffs come from 1 `git log -p` process, each commit is parsed off the pipe as soon as git writes the next one
+    '''
+    # git log fails as a whole at a missing sha, only the commits in the repo are asked
+    result = subprocess.run(['git', '-C', repo_path, 'cat-file', '--batch-check'], input=''.join(sha + '\n' for sha in shas),
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    existing_shas = [line.split()[0] for line in result.stdout.splitlines() if line.split()[1:2] == ['commit']]
+    for sha in set(shas) - set(existing_shas):
+        yield sha, None
+    if len(existing_shas) == 0:
+        return
+
+    # each commit starts with the line \x01{sha} {parent shas}, then an empty line, then its diff
+    process = subprocess.Popen(['git', '-C', repo_path, 'log', '-p', f'-U{DIFF_CONTEXT}', '--no-walk=unsorted', '--stdin',
+                                '--diff-merges=first-parent', '--format=%x01%H %P'],
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    process.stdin.write(''.join(sha + '\n' for sha in existing_shas).encode()) # read by git before any output
+    process.stdin.close()
+
+    def make_diff(header, lines):
+        sha, *parents = header[1:].decode().split()
+        try:
+            # a root commit has no sha^ to diff against
+            return sha, b''.join(lines[1:]).decode() if len(parents) > 0 else None
+        except UnicodeDecodeError:
+            return sha, None
+    header, lines = None, []
+    try:
+        for line in process.stdout:
+            if line.startswith(b'\x01'):
+                if header is not None:
+                    yield make_diff(header, lines)
+                header, lines = line, []
+            else:
+                lines.append(line)
+        if header is not None:
+            yield make_diff(header, lines)
+    finally:
+        if process.poll() is None:
+            process.kill()
+        process.stdout.close()
+        process.wait()
+
+def iter_diffs(commit_urls: list[str]):
+    '''
+    Yield (commit url, text of its git diff / None if git_parse_diff gets the diff itself / the error getting it)
+    of the commits of 1 repo. By DIFF_BACKEND 'log', the diffs come from iter_log_diffs in any order: a stream writing
+    nothing for TIME_BUDGET seconds is killed and restarts from the commit it waits for. As a diff only ends when
+    the next commit starts, this commit is tried alone first, it fails rule 14 if it is stuck alone as well
+    '''
+    if DIFF_BACKEND != 'log':
+        for commit_url in commit_urls:
+            yield commit_url, None
+        return
+    repo_path = get_repo_path(ROOT_PATH, get_full_name(commit_urls[0]))
+    urls_by_sha = {commit_url.split('/')[-1]: commit_url for commit_url in commit_urls}
+    pending_shas = list(urls_by_sha.keys())
+    alone = False # only diff the first pending sha
+    while len(pending_shas) > 0:
+        done_shas = set()
+        next_idx = 0 # the sha git log writes next (missing shas are yielded before git log starts)
+        diffs = iter_log_diffs(repo_path, pending_shas[:1] if alone else pending_shas)
+        try:
+            while True:
+                while next_idx < len(pending_shas) and pending_shas[next_idx] in done_shas:
+                    next_idx += 1
+                if next_idx == len(pending_shas) or (alone and next_idx > 0):
+                    break
+                with timeout(urls_by_sha[pending_shas[next_idx]], TIME_BUDGET):
+                    diff = next(diffs, None)
+                if diff is None: # git log ended early, the rest has no diff
+                    for sha in pending_shas[next_idx: next_idx + 1] if alone else pending_shas[next_idx:]:
+                        if sha not in done_shas:
+                            yield urls_by_sha[sha], ''
+                    break
+                done_shas.add(diff[0])
+                yield urls_by_sha[diff[0]], diff[1] or ''
+            pending_shas = pending_shas[1:] if alone else []
+            alone = False
+        except ValueError as e: # timeout, git log is killed by iter_log_diffs
+            if alone:
+                yield urls_by_sha[pending_shas[0]], e
+                pending_shas = pending_shas[1:]
+                alone = False
+            else:
+                pending_shas = [sha for sha in pending_shas[next_idx:] if sha not in done_shas]
+                alone = True
+
+def git_parse_diff(commit_url: str, lang: str, strict: bool=True, git_diff_str: str=None):
+    '''
+    git_diff_str: the text of the git diff of this commit if it is already read (check iter_diffs)
+    '''
+    global ROOT_PATH
+    repo_path = get_repo_path(ROOT_PATH, get_full_name(commit_url))
+    sha = commit_url.split('/')[-1]
+    
+    # 1. get git diff 
+    with timeout(commit_url, TIME_BUDGET):
+        if git_diff_str is not None:
+            diff_sections = split_diff_sections(commit_url, git_diff_str)
+        else:
+            diff_sections = git_diff_sections(commit_url, repo_path, sha)
+    diff_line_num = sum(content.count('\n') + 1 for _, _, content in diff_sections if content is not None)
+    with timeout(commit_url, get_time_budget(diff_line_num)):
+        return parse_diff_sections(commit_url, lang, diff_sections, strict)
+
+def parse_diff_sections(commit_url: str, lang: str, diff_sections: list, strict: bool=True):
+    result_dict = {}
     # 2. parse all file names (w/ path), check if they have undesired extension
-    file_name_matches = re.finditer(r'diff --git a/(.+) b/(.+)', git_diff_str)
     file_names = []
-    for match in file_name_matches:
-        before_filename = match.group(1)
-        after_filename = match.group(2)
+    for before_filename, after_filename, _ in diff_sections:
+        if before_filename is None:
+            continue
         try:
             assert before_filename == after_filename
         except:
@@ -190,25 +331,17 @@ def git_parse_diff(commit_url: str, lang: str, strict: bool=True):
     if detect_extension(file_names):
         raise ValueError(f'3 {commit_url} Error: Contain edit on non-source files')
         
-    # 3. split into diff section, 1 section = 1 file
-    diff_sections = re.findall(r'diff --git[^\n]*\n.*?(?=\ndiff --git|$)', git_diff_str, re.DOTALL)
+    # 3. 1 diff section = 1 file
     all_edit_num = 0
-    for i, section in enumerate(diff_sections):
+    for file_name, _, after_at_symbol_content in diff_sections:
         # 2.1 parse file name (w/ path), make sure edit don't change file name
-        file_name_match = re.match(r'diff --git a/(.+) b/(.+)', section)
-        if file_name_match:
-            file_name = file_name_match.group(1)
-        else:
+        if file_name is None:
             raise ValueError(f"5 {commit_url} Error: file name contain non-ascii char")
         
         # 2.2 get the diff of the whole file
-        # (if -U{number} is set large enough, a file should contain only 1 @@ -xx,xx +xx,xx @@)
         # we can only make snapshot based on the diff of the whole file
-        match = re.search(r'@@[^\n]*\n(.+)', section, re.DOTALL)
-        if not match:
+        if after_at_symbol_content is None:
             raise ValueError(f"4 {commit_url} Error: Edit fail to match @@ -xx,xx +xx,xx @@")
-        # 匹配@@行之后的内容
-        after_at_symbol_content = match.group(1)
         # Rule 2: do not contain non-ascii chars
         if not after_at_symbol_content.isascii():
             raise ValueError(f"5 {commit_url} Error: Edit/file contain non-ascii char")
@@ -251,29 +384,78 @@ def git_parse_diff(commit_url: str, lang: str, strict: bool=True):
         raise ValueError(f'6 {commit_url} Error: Commit contain less than 3 hunk, hunk num: {all_edit_num}')
     return result_dict
 
-def clean_edit(lang):
-    with open(os.path.join(ROOT_PATH, f'commit_info/{lang}_filtered_commit_urls.json'), 'r') as f:
-        commit_urls = json.load(f)
-    cnt = 0
-    error_cnt = {}
+def clean_repo_edits(task):
+    '''
+    Worker: filter the commits of (a shard of) 1 repo, task: (lang, commit urls),
+    return ({commit url: snapshot}, {rule label: count}, number of commits done, False if stopped at an unexpected error)
+    '''
+    lang, commit_urls = task
     commit_snapshots = {}
-    for commit_idx, commit_url in enumerate(tqdm(commit_urls)):
+    error_cnt = {}
+    commit_num = 0
+    for commit_url, git_diff_str in iter_diffs(commit_urls):
+        commit_num += 1
         try:
-            result_dict = git_parse_diff(commit_url, lang)
-            cnt += 1
-            commit_snapshots[commit_url] = result_dict
+            if isinstance(git_diff_str, Exception):
+                raise git_diff_str
+            commit_snapshots[commit_url] = git_parse_diff(commit_url, lang, git_diff_str=git_diff_str)
         except Exception as e:
             label = str(e).split(' ')[0]
-            if label not in ['1', '2', '3', '4', '5', '6', '7', '8', '9', '10', '11', '12', '13', '14']:
+            if label not in ['1', '2', '3', '4', '5', '6', '7', '8', '9', '10', '11', '12', '13', '14', '15']:
                 print('other error: ', e)
                 print(commit_url)
-                break
+                return commit_snapshots, error_cnt, commit_num, False
             else:
                 if label not in error_cnt:
                     error_cnt[label] = 1
                 else:
                     error_cnt[label] += 1
             continue
+    return commit_snapshots, error_cnt, commit_num, True
+
+def clean_edit(lang):
+    with open(os.path.join(ROOT_PATH, f'commit_info/{lang}_filtered_commit_urls.json'), 'r') as f:
+        commit_urls = json.load(f)
+    error_cnt = {}
+    commit_snapshots = {}
+    # checked before the diff, so no git diff is spent on duplicates
+    seen = SeenCommits(get_seen_commits_path(ROOT_PATH))
+    duplicate_urls = {commit_url for commit_url in commit_urls if not seen.claim(commit_url.split('/')[-1], commit_url)}
+    seen.close()
+    if len(duplicate_urls) > 0:
+        error_cnt['15'] = len(duplicate_urls) # rule 8 of 2_clean_commit_info
+    # 1 task = a shard of the commits of 1 repo, so 1 git process serves many commits
+    urls_by_repo = {}
+    for commit_url in commit_urls:
+        if commit_url not in duplicate_urls:
+            urls_by_repo.setdefault(get_full_name(commit_url), []).append(commit_url)
+    tasks = [(lang, repo_urls[idx: idx + SHARD_SIZE]) for repo_urls in urls_by_repo.values()
+             for idx in range(0, len(repo_urls), SHARD_SIZE)]
+    pbar = tqdm(total=len(commit_urls))
+    pbar.update(len(duplicate_urls))
+
+    def handle(result):
+        # merge the result of a task, return False at an unexpected error
+        task_snapshots, task_error_cnt, commit_num, finished = result
+        commit_snapshots.update(task_snapshots)
+        for label, error_num in task_error_cnt.items():
+            error_cnt[label] = error_cnt.get(label, 0) + error_num
+        pbar.update(commit_num)
+        return finished
+
+    if NUM_WORKERS <= 1:
+        for task in tasks:
+            if not handle(clean_repo_edits(task)):
+                break
+    else:
+        with Pool(NUM_WORKERS) as pool: # terminated when leaving, also at an unexpected error
+            for result in pool.imap_unordered(clean_repo_edits, tasks):
+                if not handle(result):
+                    break
+    pbar.close()
+    cnt = len(commit_snapshots)
+    # in the order of the filtered commit urls, whatever order they were filtered in
+    commit_snapshots = {commit_url: commit_snapshots[commit_url] for commit_url in commit_urls if commit_url in commit_snapshots}
     
     if not os.path.exists(os.path.join(ROOT_PATH, 'qualified_commit')):
         os.mkdir(os.path.join(ROOT_PATH, 'qualified_commit'))
@@ -296,7 +478,8 @@ def clean_edit(lang):
         "11": "Contain edit on less than 2 files",
         "12": "Edit/file contain edit tags",
         "13": "Fail to parse finer grain snapshot",
-        "14": "Runtime exceeded 10 seconds"
+        "14": "Runtime exceeded the time budget",
+        "15": DUPLICATE_DESCRIPTION # rule 8 of 2_clean_commit_info
     }
     for error_idx, error_num in error_cnt.items():
         print(f'Rule {error_idx} {error_dict[error_idx]}: {error_num}')
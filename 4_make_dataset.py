@@ -9,6 +9,7 @@ import transformers
 
 from tqdm import tqdm
 from llama import *
+from commit_store import open_commit_store
 
 ROOT_PATH = "/media/chenyan"
 transformers.utils.logging.set_verbosity_error()
@@ -409,8 +410,7 @@ def make_dataset(lang, dataset_name: str, snapshots_by_commit = None, auto_save
         with open(os.path.join(ROOT_PATH, "qualified_commit", f"{lang}_qualified_commit_snapshots.json"), "r") as f:
             snapshots_by_commit = json.load(f)
     
-    with open(os.path.join(ROOT_PATH, "commit_info", f"{lang}_commit_info.jsonl"), "r") as f:
-        commits_info = [json.loads(line) for line in f.readlines()]
+    store = open_commit_store(ROOT_PATH, lang)
     
     dataset = {}
     rejcted_commit_cnt = 0
@@ -418,11 +418,9 @@ def make_dataset(lang, dataset_name: str, snapshots_by_commit = None, auto_save
     for commit_idx, (commit_url, snapshots) in enumerate(tqdm(snapshots_by_commit.items())):
         dataset[commit_url] = {}
         # find commit msg
-        for commit_info in commits_info:
-            if commit_url == commit_info["html_url"]:
-                commit_msg = commit_info["commit"]["message"]
-                break
+        commit_info = store.get(commit_url, ["message"])
         try:
+            commit_msg = commit_info["message"]
             dataset[commit_url]["commit_msg"] = filter_clean_msg_with_llama(commit_msg, llama3, llama3_tokenizer)
             dataset[commit_url]["original_commit_msg"] = commit_msg
         except:
@@ -763,6 +761,7 @@ def make_dataset(lang, dataset_name: str, snapshots_by_commit = None, auto_save
         sample_number = min(sample_number, len(type3_sliding_windows))
         type3_sliding_windows = random.sample(type3_sliding_windows, sample_number)
         dataset[commit_url]["sliding_windows"].extend(type3_sliding_windows)
+    store.close()
 
     print(f"Rejected commit percentage: {rejcted_commit_cnt / len(snapshots_by_commit)}")
     if not os.path.exists(os.path.join(ROOT_PATH, dataset_name, lang)):
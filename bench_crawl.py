@@ -0,0 +1,116 @@
+# This script benchmarks 1_crawl.crawl against fake_github.py, so crawler changes can be measured offline and reproducibly
+# It reports:
+# 1. requests/sec: API requests received by the fake server per second of crawl()
+# 2. usable commits per quota unit: commits passing 2_clean_commit_info.commit_filter / requests charged to the rate limit
+# 3. time to first commit: seconds from the start of crawl() until the first commit is written to commit_info
+import os
+import sys
+import json
+import time
+import tempfile
+import argparse
+import threading
+from importlib import import_module
+
+from fake_github import FakeGithub
+
+def watch_first_commit(work_dir, lang, start, result, stop):
+    # poll the commit info file, record when its first record arrives
+    paths = [os.path.join(work_dir, "commit_info", f"{lang}_commit_info.jsonl" + suffix) for suffix in ["", ".zst"]]
+    while not stop.is_set():
+        for path in paths:
+            if os.path.exists(path) and os.path.getsize(path) > 0:
+                result["time_to_first_commit"] = time.time() - start
+                return
+        time.sleep(0.01)
+
+def bench(lang="python", repo_num=20, commit_num=300, token_num=2, data_dir=None, latency=0.05, core_limit=5000, window=3600,
+          commit_source="rest", clone_mode="full", use_cache=False, rerun=False):
+    '''
+    Run crawl() once (twice if rerun, the second run is measured) against a fresh fake GitHub, return the metrics
+    '''
+    data_dir = data_dir or tempfile.mkdtemp(prefix="fake_github_")
+    server = FakeGithub(data_dir, [lang], repo_num, commit_num, latency=latency,
+                        limits={"core": core_limit}, window=window)
+    base_url = server.start_in_thread()
+
+    # 1_crawl reads its configuration when imported, prepare the environment and working directory first
+    work_dir = tempfile.mkdtemp(prefix="bench_crawl_")
+    os.environ["GITHUB_API_URL"] = base_url
+    os.environ["GITHUB_URL"] = base_url
+    os.environ["GITHUB_TOKENS"] = ",".join(f"bench-token-{i}" for i in range(token_num))
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(work_dir)
+    step_1 = import_module("1_crawl")
+    step_2 = import_module("2_clean_commit_info")
+    step_1.ROOT_PATH = work_dir
+    step_1.PROXY_POOL = None # never probe the internet
+    step_1.COMMIT_SOURCE = commit_source
+    step_1.CLONE_MODE = clone_mode
+    if not use_cache:
+        step_1.CACHE = None
+
+    if rerun:
+        step_1.crawl(lang, repo_num)
+        if use_cache: # a warm cache, but no checkpoints, everything is re-requested conditionally
+            os.remove(os.path.join(work_dir, "commit_info", f"{lang}_checkpoints.json"))
+            for suffix in ["", ".zst"]: # the first commit of the measured run must not be the old file
+                if os.path.exists(os.path.join(work_dir, "commit_info", f"{lang}_commit_info.jsonl" + suffix)):
+                    os.remove(os.path.join(work_dir, "commit_info", f"{lang}_commit_info.jsonl" + suffix))
+        server.stats.update({"requests": 0, "charged": 0, "not_modified": 0, "rate_limited": 0,
+                             "bytes": 0, "git_bytes": 0, "by_endpoint": {}})
+
+    result = {"time_to_first_commit": None}
+    stop = threading.Event()
+    start = time.time()
+    watcher = threading.Thread(target=watch_first_commit, args=(work_dir, lang, start, result, stop), daemon=True)
+    watcher.start()
+    step_1.crawl(lang, repo_num)
+    elapsed = time.time() - start
+    stop.set()
+
+    commit_io = import_module("commit_io")
+    usable = 0
+    commits = 0
+    for commit in commit_io.iter_commit_info(commit_io.get_commit_info_path(work_dir, lang)):
+        commits += 1
+        try:
+            step_2.commit_filter(commit)
+            usable += 1
+        except ValueError:
+            pass
+    api_requests = server.stats["requests"] - server.stats["by_endpoint"].get("git", 0)
+    result.update({
+        "commit_source": commit_source,
+        "elapsed": elapsed,
+        "api_requests": api_requests,
+        "requests_per_sec": api_requests / elapsed,
+        "charged_quota": server.stats["charged"],
+        "not_modified": server.stats["not_modified"],
+        "rate_limited": server.stats["rate_limited"],
+        "api_bytes": server.stats["bytes"],
+        "git_bytes": server.stats["git_bytes"],
+        "commits": commits,
+        "usable_commits": usable,
+        "usable_commits_per_quota": usable / max(server.stats["charged"], 1)
+    })
+    return result
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lang", default="python")
+    parser.add_argument("--repo-num", type=int, default=20)
+    parser.add_argument("--commit-num", type=int, default=300)
+    parser.add_argument("--token-num", type=int, default=2)
+    parser.add_argument("--data-dir", default=None, help="reuse the generated synthetic repos between runs")
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--core-limit", type=int, default=5000)
+    parser.add_argument("--window", type=int, default=3600, help="seconds until the rate limit resets")
+    parser.add_argument("--commit-source", default="rest", choices=["rest", "graphql", "git"])
+    parser.add_argument("--clone-mode", default="full")
+    parser.add_argument("--use-cache", action="store_true")
+    parser.add_argument("--rerun", action="store_true", help="measure the second crawl of the same repos")
+    args = parser.parse_args()
+    result = bench(args.lang, args.repo_num, args.commit_num, args.token_num, args.data_dir, args.latency, args.core_limit, args.window,
+                   args.commit_source, args.clone_mode, args.use_cache, args.rerun)
+    print(json.dumps(result, indent=4))
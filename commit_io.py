@@ -0,0 +1,120 @@
+# This script writes and reads {ROOT_PATH}/commit_info/{lang}_commit_info.jsonl
+# 1. Each commit is projected to the fields used by the pipeline, the nested structure of the GitHub API is kept,
+#    so commit['commit']['message'], commit['author']['type'], ... still work
+# 2. Commits are appended batch by batch (1 batch = the commits of 1 repo), and read back as a stream
+# 3. Optionally, the file is compressed by zstd ({lang}_commit_info.jsonl.zst, 1 zstd frame per batch),
+#    and the raw API payloads are kept in {lang}_commit_info_raw.jsonl(.zst)
+# 4. Commits rejected while crawling can be kept as compact records in {lang}_rejected_commits.jsonl(.zst)
+import io
+import os
+import re
+import json
+
+def project_commit(commit):
+    # keep only the fields read by 1_crawl, 2_clean_commit_info and 4_make_dataset
+    def project_user(user):
+        if user is None:
+            return None
+        return {"login": user.get("login"), "type": user.get("type")}
+    return {
+        "sha": commit["sha"],
+        "html_url": commit["html_url"],
+        "commit": {
+            "message": commit["commit"]["message"],
+            "committer": {"date": commit["commit"]["committer"]["date"]}
+        },
+        "author": project_user(commit.get("author")),
+        "committer": project_user(commit.get("committer")),
+        "parents": [{"sha": parent["sha"]} for parent in commit.get("parents", [])]
+    }
+
+def parse_noreply_email(email):
+    # the noreply addresses of GitHub tell the user of a commit email without any request
+    if email == "noreply@github.com": # commits made on the web are committed by web-flow
+        return {"login": "web-flow", "type": "User"}
+    match = re.match(r'(?:\d+\+)?([^@]+)@users\.noreply\.github\.com$', email)
+    if match is None:
+        return None
+    login = match.group(1)
+    return {"login": login, "type": "Bot" if login.endswith("[bot]") else "User"}
+
+def get_commit_info_path(root_path, lang, raw=False):
+    '''
+    Return the path of the commit info file of this language, the compressed file is preferred if both exist
+    '''
+    name = f'{lang}_commit_info_raw.jsonl' if raw else f'{lang}_commit_info.jsonl'
+    path = os.path.join(root_path, 'commit_info', name)
+    if os.path.exists(path + '.zst'):
+        return path + '.zst'
+    return path
+
+class CommitWriter:
+    def __init__(self, root_path, lang, compress=False, keep_raw=False, keep_rejects=False):
+        suffix = '.zst' if compress else ''
+        self.path = os.path.join(root_path, 'commit_info', f'{lang}_commit_info.jsonl' + suffix)
+        self.raw_path = os.path.join(root_path, 'commit_info', f'{lang}_commit_info_raw.jsonl' + suffix) if keep_raw else None
+        self.reject_path = os.path.join(root_path, 'commit_info', f'{lang}_rejected_commits.jsonl' + suffix) if keep_rejects else None
+        self.compressor = None
+        if compress:
+            import zstandard # optional dependency, only needed when compress is True
+            self.compressor = zstandard.ZstdCompressor(level=10)
+
+    def truncate(self):
+        # start new files, used by the first run of a language
+        for path in [self.path, self.raw_path, self.reject_path]:
+            if path is not None:
+                open(path, 'wb').close()
+
+    def append(self, path, records):
+        data = "".join(json.dumps(record) + "\n" for record in records).encode()
+        if self.compressor is not None:
+            data = self.compressor.compress(data)
+        with open(path, 'ab') as f:
+            f.write(data)
+            f.flush()
+
+    def write_all(self, commits, raw_commits=None):
+        '''
+        Append the projected commits, raw_commits (default: the same commits) are appended to the raw file if it is kept
+        '''
+        if len(commits) > 0:
+            self.append(self.path, [project_commit(commit) for commit in commits])
+        raw_commits = commits if raw_commits is None else raw_commits
+        if self.raw_path is not None and len(raw_commits) > 0:
+            self.append(self.raw_path, raw_commits)
+
+    def write_rejects(self, rejects):
+        # rejects: [{"sha", "html_url", "rule"}, ...]
+        if self.reject_path is not None and len(rejects) > 0:
+            self.append(self.reject_path, rejects)
+
+def iter_commit_info_lines(path):
+    # yield the JSON lines of a (maybe zstd compressed) commit info file, not parsed yet
+    with open(path, 'rb') as f:
+        if path.endswith('.zst'):
+            import zstandard
+            f = zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True)
+        for line in io.TextIOWrapper(f, encoding='utf-8'):
+            if line.strip() != "":
+                yield line
+
+def iter_commit_info_lines_at(path, offset=0):
+    '''
+    Yield (JSON line, byte offset after it) of a plain (not compressed) commit info file, starting at the byte offset.
+    A last line without '\n' is still being written, it is not yielded
+    '''
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            offset += len(line)
+            if line.strip() != b"":
+                yield line.decode('utf-8'), offset
+
+def iter_commit_info(path):
+    '''
+    Yield the commits of a (maybe zstd compressed) commit info file one by one
+    '''
+    for line in iter_commit_info_lines(path):
+        yield json.loads(line)
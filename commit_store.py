@@ -0,0 +1,201 @@
+# This script is an indexed store of the commit information, read by every stage after 1_crawl.py
+# 1. {ROOT_PATH}/commit_info/{lang}_commit_info.jsonl(.zst) stays the file written by the crawler / ingester,
+#    the store {ROOT_PATH}/commit_info/{lang}_commits.sqlite is synced from it: only lines appended since the last sync are parsed.
+#    A plain file is read from the byte offset the last sync stopped at, a .zst file is decompressed from its start
+#    (the lines imported before are skipped without parsing them). A rewritten file is imported again
+# 2. 1 row per commit, 1 column per field of commit_io.project_commit, indexed by html_url, sha and repo
+# 3. Access API: get a commit by url, iterate the commits (of a repo) in file order, and only read the selected columns
+import os
+import json
+import hashlib
+import sqlite3
+
+from commit_io import get_commit_info_path, iter_commit_info_lines, iter_commit_info_lines_at
+
+COLUMNS = ["html_url", "sha", "repo", "message", "date", "author_login", "author_type",
+           "committer_login", "committer_type", "parents"]
+
+def get_commit_store_path(root_path, lang):
+    return os.path.join(root_path, 'commit_info', f'{lang}_commits.sqlite')
+
+def commit_to_row(commit):
+    author = commit.get('author') or {}
+    committer = commit.get('committer') or {}
+    return (
+        commit['html_url'],
+        commit['sha'],
+        "/".join(commit['html_url'].split('/')[-4:-2]),
+        commit['commit']['message'],
+        commit['commit']['committer']['date'],
+        author.get('login'),
+        author.get('type'),
+        committer.get('login'),
+        committer.get('type'),
+        json.dumps([parent['sha'] for parent in commit.get('parents', [])])
+    )
+
+def row_to_commit(row):
+    '''
+    Rebuild the commit of commit_io.project_commit from a row of all COLUMNS, so commit['commit']['message'] etc. still work
+    '''
+    html_url, sha, _, message, date, author_login, author_type, committer_login, committer_type, parents = row
+    return {
+        "sha": sha,
+        "html_url": html_url,
+        "commit": {
+            "message": message,
+            "committer": {"date": date}
+        },
+        "author": None if author_login is None and author_type is None else {"login": author_login, "type": author_type},
+        "committer": None if committer_login is None and committer_type is None else {"login": committer_login, "type": committer_type},
+        "parents": [{"sha": parent} for parent in json.loads(parents)]
+    }
+
+def get_tail_hash(path, offset, size=4096):
+    # the hash of the (up to) size bytes before the offset of a file
+    with open(path, 'rb') as f:
+        f.seek(max(0, offset - size))
+        return hashlib.sha1(f.read(min(offset, size))).hexdigest()
+
+class CommitStore:
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS commits (
+                html_url TEXT PRIMARY KEY,
+                sha TEXT,
+                repo TEXT,
+                message TEXT,
+                date TEXT,
+                author_login TEXT,
+                author_type TEXT,
+                committer_login TEXT,
+                committer_type TEXT,
+                parents TEXT
+            )""")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS commits_sha ON commits (sha)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS commits_repo ON commits (repo)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.conn.commit()
+
+    def get_meta(self, key):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return None if row is None else row[0]
+
+    def sync(self, commit_info_path, batch_size=10000):
+        '''
+        Import the lines of the commit info file not imported yet, return the number of new commits
+        '''
+        if not os.path.exists(commit_info_path):
+            return 0
+        if not commit_info_path.endswith('.zst'):
+            return self.sync_from_offset(commit_info_path, batch_size)
+        imported_lines = int(self.get_meta('lines') or 0)
+        first_line_hash = self.get_meta('first_line')
+        new_commit_num = 0
+        batch = []
+        line_idx = 0
+        for line_idx, line in enumerate(iter_commit_info_lines(commit_info_path), start=1):
+            if line_idx == 1:
+                line_hash = hashlib.sha1(line.encode()).hexdigest()
+                if (self.get_meta('path'), first_line_hash) != (commit_info_path, line_hash): # a new file, import it again
+                    self.conn.execute("DELETE FROM commits")
+                    imported_lines = 0
+                    self.conn.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)", [('path', commit_info_path), ('first_line', line_hash)])
+            if line_idx == imported_lines and hashlib.sha1(line.encode()).hexdigest() != self.get_meta('last_line'):
+                break # the last imported line changed, the file has been rewritten
+            if line_idx <= imported_lines:
+                continue
+            batch.append(commit_to_row(json.loads(line)))
+            if len(batch) >= batch_size:
+                new_commit_num += self.insert(batch)
+                batch = []
+        new_commit_num += self.insert(batch)
+        if line_idx <= imported_lines and imported_lines > 0 and \
+                (line_idx < imported_lines or hashlib.sha1(line.encode()).hexdigest() != self.get_meta('last_line')):
+            # the file is shorter than before or its last imported line changed, it has been rewritten
+            self.conn.execute("DELETE FROM commits")
+            self.conn.execute("DELETE FROM meta")
+            self.conn.commit()
+            return self.sync(commit_info_path, batch_size)
+        if line_idx > 0:
+            self.conn.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                                  [('lines', str(line_idx)), ('last_line', hashlib.sha1(line.encode()).hexdigest())])
+        self.conn.commit()
+        return new_commit_num
+
+    def sync_from_offset(self, commit_info_path, batch_size=10000):
+        # sync of a plain file, only the bytes after the offset of the last sync are read
+        with open(commit_info_path, 'rb') as f:
+            line_hash = hashlib.sha1(f.readline()).hexdigest()
+        offset = int(self.get_meta('offset') or 0)
+        # the bytes before the offset must be the ones imported, otherwise the offset may be in the middle of a line
+        if (self.get_meta('path'), self.get_meta('first_line')) != (commit_info_path, line_hash) \
+                or os.path.getsize(commit_info_path) < offset \
+                or get_tail_hash(commit_info_path, offset) != self.get_meta('tail'): # a new or rewritten file, import it again
+            self.conn.execute("DELETE FROM commits")
+            self.conn.execute("DELETE FROM meta")
+            self.conn.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)", [('path', commit_info_path), ('first_line', line_hash)])
+            offset = 0
+        new_commit_num = 0
+        batch = []
+        for line, offset in iter_commit_info_lines_at(commit_info_path, offset):
+            batch.append(commit_to_row(json.loads(line)))
+            if len(batch) >= batch_size:
+                new_commit_num += self.insert(batch)
+                batch = []
+        new_commit_num += self.insert(batch)
+        self.conn.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                              [('offset', str(offset)), ('tail', get_tail_hash(commit_info_path, offset))])
+        self.conn.commit()
+        return new_commit_num
+
+    def insert(self, rows):
+        # the first record of a url is kept
+        before = self.conn.total_changes
+        self.conn.executemany(f"INSERT OR IGNORE INTO commits ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})", rows)
+        return self.conn.total_changes - before
+
+    def get(self, html_url, columns=None):
+        '''
+        Return the commit of this url, as a dict of the selected columns (all COLUMNS if None), or None if it is not stored
+        '''
+        columns = columns or COLUMNS
+        row = self.conn.execute(f"SELECT {', '.join(columns)} FROM commits WHERE html_url = ?", (html_url,)).fetchone()
+        return None if row is None else dict(zip(columns, row))
+
+    def get_commit(self, html_url):
+        # the commit in the schema of commit_io.project_commit
+        row = self.conn.execute(f"SELECT {', '.join(COLUMNS)} FROM commits WHERE html_url = ?", (html_url,)).fetchone()
+        return None if row is None else row_to_commit(row)
+
+    def iter_rows(self, columns=None, repo=None):
+        '''
+        Yield the tuples of the selected columns of every commit (of this repo), in the order of the commit info file
+        '''
+        columns = columns or COLUMNS
+        query = f"SELECT {', '.join(columns)} FROM commits"
+        if repo is not None:
+            yield from self.conn.execute(query + " WHERE repo = ? ORDER BY rowid", (repo,))
+        else:
+            yield from self.conn.execute(query + " ORDER BY rowid")
+
+    def iter_commits(self, repo=None):
+        for row in self.iter_rows(COLUMNS, repo):
+            yield row_to_commit(row)
+
+    def count(self):
+        return self.conn.execute("SELECT COUNT(*) FROM commits").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+def open_commit_store(root_path, lang):
+    '''
+    Open the commit store of this language, synced with its commit info file
+    '''
+    store = CommitStore(get_commit_store_path(root_path, lang))
+    store.sync(get_commit_info_path(root_path, lang))
+    return store
@@ -0,0 +1,499 @@
+# This script is a local stand-in of GitHub, used to run and benchmark 1_crawl.py without spending real quota
+# 1. It serves /search/repositories, /repos/{user}/{proj}/commits(/{sha}), /graphql and git smart-HTTP (git clone / fetch)
+# 2. Data is either synthetic (git repos generated by git fast-import, the API serves their real history),
+#    or recorded ({record_dir}/repo_info/{lang}_top_star_repos.jsonl and {record_dir}/commit_info/{lang}_commit_info_raw.jsonl)
+# 3. It emulates pagination (Link header, the 1000 results cap of search), ETag / 304,
+#    rate limit headers and 403 when a token is used up, secondary rate limit (403 + Retry-After) and latency
+# Run it alone: python fake_github.py --port 8000, then set GITHUB_API_URL=GITHUB_URL=http://127.0.0.1:8000
+import os
+import re
+import json
+import time
+import random
+import asyncio
+import hashlib
+import argparse
+import threading
+import subprocess
+from aiohttp import web
+from datetime import datetime, timedelta, timezone
+
+DEFAULT_LIMIT = {
+    "core": 5000,
+    "search": 30,
+    "graphql": 5000
+}
+
+# commit messages of synthetic commits, some pass 2_clean_commit_info.commit_filter, some are rejected by each rule
+MESSAGES = [
+    "Fix off by one error when reading the last line of the input buffer",
+    "Add retry logic around the connection pool so that transient errors are hidden",
+    "Refactor the token parser to share the state machine between both modes",
+    "Remove the deprecated helper and inline its only caller in the module",
+    "Improve the error message shown when the config value has the wrong type",
+    "Update README.md",
+    "Bump version",
+    "Merge pull request #42 from someone/feature-branch\n\nAdd the new option to the command line",
+    "Merge branch 'main' into develop and resolve the conflicts in the tests",
+    "Fix typo and add tests for the new argument of the loader",
+    "See https://example.com/issues/12 for why we need to fix the cache key here",
+    "修复 读取 配置 文件 时 的 编码 问题 以及 相关 测试",
+    "Change the default timeout in utils.py from ten seconds to thirty seconds"
+]
+# authors of synthetic commits: (name, email, GitHub user of the email), mostly real users, some bots and some unknown emails
+AUTHORS = [
+    ("Dev", "dev@example.com", {"login": "dev", "type": "User"}),
+    ("Dev Two", "1234+dev2@users.noreply.github.com", {"login": "dev2", "type": "User"}),
+    ("Bot", "bot@example.com", {"login": "bot[bot]", "type": "Bot"}),
+    ("Unknown", "unknown@example.com", None)
+]
+AUTHOR_WEIGHTS = [14, 3, 2, 1]
+EXTENSIONS = {
+    "python": ".py",
+    "java": ".java",
+    "go": ".go",
+    "javascript": ".js",
+    "typescript": ".ts"
+}
+
+def make_synthetic_repo(git_path, lang, commit_num, file_num=8, seed=0):
+    '''
+    Generate a bare git repo with commit_num linear commits on main by git fast-import,
+    each commit edits a few lines of 1 ~ 4 source files
+    '''
+    rng = random.Random(seed)
+    ext = EXTENSIONS.get(lang, ".txt")
+    files = {f"src/module_{k}{ext}": [f"line {i} of module {k}\n" for i in range(200)] for k in range(file_num)}
+    start = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    stream = []
+    for idx in range(commit_num):
+        timestamp = int((start + timedelta(hours=idx)).timestamp())
+        message = rng.choice(MESSAGES).encode()
+        name, email, _ = rng.choices(AUTHORS, weights=AUTHOR_WEIGHTS)[0]
+        stream.append(f"commit refs/heads/main\nmark :{idx+1}\n"
+                      f"author {name} <{email}> {timestamp} +0000\n"
+                      f"committer {name} <{email}> {timestamp} +0000\n"
+                      f"data {len(message)}\n".encode() + message + b"\n")
+        if idx > 0:
+            stream.append(f"from :{idx}\n".encode())
+        for path in (files.keys() if idx == 0 else rng.sample(sorted(files.keys()), rng.randint(1, 4))):
+            lines = files[path]
+            for _ in range(rng.randint(1, 3)):
+                pos = rng.randint(10, len(lines) - 10)
+                lines[pos] = f"edited line {pos} in commit {idx}\n"
+            content = "".join(lines).encode()
+            stream.append(f"M 100644 inline {path}\ndata {len(content)}\n".encode() + content + b"\n")
+    os.makedirs(git_path, exist_ok=True)
+    subprocess.run(["git", "init", "--quiet", "--bare", "--initial-branch=main", git_path], check=True)
+    subprocess.run(["git", "fast-import", "--quiet"], input=b"".join(stream), cwd=git_path, check=True)
+
+def read_git_files(git_path, sha):
+    # the "files" of a commit object of the API: 1 item per changed file, with its -U3 patch
+    diff = subprocess.run(["git", "diff-tree", "-p", "-U3", "-r", "--root", "--no-commit-id", sha],
+                          cwd=git_path, capture_output=True, check=True).stdout.decode(errors="replace")
+    files = []
+    for section in re.findall(r"diff --git [^\n]*\n.*?(?=\ndiff --git |$)", diff, re.DOTALL):
+        filename = re.match(r"diff --git a/(.+) b/(.+)", section).group(2)
+        status = "modified"
+        if "\nnew file mode" in section:
+            status = "added"
+        elif "\ndeleted file mode" in section:
+            status = "removed"
+        elif "\nrename from" in section:
+            status = "renamed"
+        hunk_start = section.find("\n@@")
+        patch = section[hunk_start + 1:] if hunk_start >= 0 else None
+        lines = patch.splitlines() if patch is not None else []
+        additions = sum(1 for line in lines if line.startswith("+"))
+        deletions = sum(1 for line in lines if line.startswith("-"))
+        file = {"filename": filename, "status": status, "additions": additions, "deletions": deletions,
+                "changes": additions + deletions}
+        if patch is not None:
+            file["patch"] = patch
+        files.append(file)
+    return files
+
+def read_git_commits(git_path, api_url, html_url, full_name):
+    # build REST API commit objects (newest first) from the history of a synthetic repo
+    log = subprocess.run(["git", "log", "--format=%H%x00%P%x00%cI%x00%ae%x00%B%x1e", "main"],
+                         cwd=git_path, capture_output=True, check=True).stdout.decode()
+    commits = []
+    for record in log.split("\x1e"):
+        record = record.strip("\n")
+        if record == "":
+            continue
+        sha, parents, date, email, message = record.split("\x00")
+        # the GitHub user is decided by the email, like GitHub does
+        name, account = {author[1]: (author[0], author[2]) for author in AUTHORS}.get(email, ("Dev", None))
+        user = None if account is None else {
+            "login": account["login"],
+            "id": AUTHORS.index((name, email, account)) + 1,
+            "type": account["type"],
+            "avatar_url": "https://avatars.githubusercontent.com/u/1?v=4",
+            "url": f"{api_url}/users/{account['login']}",
+            "html_url": f"{html_url}/{account['login']}",
+            "followers_url": f"{api_url}/users/{account['login']}/followers",
+            "repos_url": f"{api_url}/users/{account['login']}/repos"
+        }
+        commits.append({
+            "sha": sha,
+            "node_id": "C_" + sha[:20],
+            "commit": {
+                "author": {"name": name, "email": email, "date": date},
+                "committer": {"name": name, "email": email, "date": date},
+                "message": message.rstrip("\n"),
+                "tree": {"sha": sha, "url": f"{api_url}/repos/{full_name}/git/trees/{sha}"},
+                "url": f"{api_url}/repos/{full_name}/git/commits/{sha}",
+                "comment_count": 0,
+                "verification": {"verified": False, "reason": "unsigned", "signature": None, "payload": None}
+            },
+            "url": f"{api_url}/repos/{full_name}/commits/{sha}",
+            "html_url": f"{html_url}/{full_name}/commit/{sha}",
+            "comments_url": f"{api_url}/repos/{full_name}/commits/{sha}/comments",
+            "author": user,
+            "committer": user,
+            "parents": [{"sha": parent, "url": f"{api_url}/repos/{full_name}/commits/{parent}",
+                         "html_url": f"{html_url}/{full_name}/commit/{parent}"} for parent in parents.split()]
+        })
+    return commits
+
+class FakeGithub:
+    def __init__(self, data_dir, langs=("python",), repo_num=20, commit_num=300, record_dir=None,
+                 limits=None, window=3600, latency=0.05, jitter=0.05,
+                 secondary_concurrency=100, secondary_retry_after=5, seed=0):
+        '''
+        data_dir: where the synthetic git repos are generated
+        limits: the rate limit of each token per window, e.g. {"core": 5000, "search": 30, "graphql": 5000}
+        secondary_concurrency: a token with more in-flight requests than this gets a secondary rate limit 403
+        '''
+        self.data_dir = data_dir
+        self.limits = {**DEFAULT_LIMIT, **(limits or {})}
+        self.window = window
+        self.latency = latency
+        self.jitter = jitter
+        self.secondary_concurrency = secondary_concurrency
+        self.secondary_retry_after = secondary_retry_after
+        self.rng = random.Random(seed)
+        self.buckets = {} # (token, resource) -> [remaining, reset]
+        self.in_flight = {}
+        self.stats = {"requests": 0, "charged": 0, "not_modified": 0, "rate_limited": 0,
+                      "bytes": 0, "git_bytes": 0, "by_endpoint": {}, "first_request": None}
+        self.repos = {} # lang -> repo items
+        self.commits = {} # full_name -> commits, newest first
+        self.base_url = None
+        self.api_url = "https://api.github.com" # replaced by the real address once started
+        if record_dir is not None:
+            self.load_recorded(record_dir, langs)
+        else:
+            self.make_synthetic(langs, repo_num, commit_num, seed)
+
+    def make_synthetic(self, langs, repo_num, commit_num, seed):
+        for lang in langs:
+            self.repos[lang] = []
+            for idx in range(repo_num):
+                full_name = f"{lang}-owner-{idx}/{lang}-proj-{idx}"
+                git_path = os.path.join(self.data_dir, "git", full_name + ".git")
+                if not os.path.exists(git_path):
+                    make_synthetic_repo(git_path, lang, commit_num, seed=seed * 100003 + idx)
+                self.repos[lang].append({
+                    "id": len(self.commits) + 1,
+                    "full_name": full_name,
+                    "name": full_name.split("/")[1],
+                    "owner": {"login": full_name.split("/")[0], "type": "User"},
+                    "html_url": f"https://github.com/{full_name}",
+                    "description": f"synthetic {lang} repo {idx}",
+                    "fork": False,
+                    "created_at": f"{2010 + idx % 10}-01-01T00:00:00Z",
+                    "updated_at": "2024-01-01T00:00:00Z",
+                    "pushed_at": "2024-01-01T00:00:00Z",
+                    "stargazers_count": 100000 // (idx + 1),
+                    "language": lang,
+                    "default_branch": "main"
+                })
+                self.commits[full_name] = None # read from git lazily, once the real address is known
+
+    def load_recorded(self, record_dir, langs):
+        for lang in langs:
+            with open(os.path.join(record_dir, "repo_info", f"{lang}_top_star_repos.jsonl"), "r") as f:
+                self.repos[lang] = [json.loads(line) for line in f if line.strip() != ""]
+            for repo in self.repos[lang]:
+                self.commits[repo["full_name"]] = []
+            commit_path = os.path.join(record_dir, "commit_info", f"{lang}_commit_info_raw.jsonl")
+            if not os.path.exists(commit_path):
+                commit_path = os.path.join(record_dir, "commit_info", f"{lang}_commit_info.jsonl")
+            with open(commit_path, "r") as f:
+                for line in f:
+                    if line.strip() == "":
+                        continue
+                    commit = json.loads(line)
+                    full_name = "/".join(commit["html_url"].split("/")[-4:-2])
+                    self.commits.setdefault(full_name, []).append(commit)
+
+    def get_commits(self, full_name):
+        if full_name not in self.commits:
+            return None
+        if self.commits[full_name] is None:
+            git_path = os.path.join(self.data_dir, "git", full_name + ".git")
+            self.commits[full_name] = read_git_commits(git_path, self.api_url, "https://github.com", full_name)
+        return self.commits[full_name]
+
+    # ---------------------- rate limit ----------------------
+    def get_bucket(self, token, resource):
+        now = time.time()
+        bucket = self.buckets.get((token, resource))
+        if bucket is None or bucket[1] <= now:
+            bucket = [self.limits[resource], int(now) + self.window]
+            self.buckets[(token, resource)] = bucket
+        return bucket
+
+    def rate_limit_headers(self, bucket, resource):
+        return {
+            "X-RateLimit-Limit": str(self.limits[resource]),
+            "X-RateLimit-Remaining": str(max(bucket[0], 0)),
+            "X-RateLimit-Reset": str(bucket[1]),
+            "X-RateLimit-Resource": resource
+        }
+
+    def respond(self, request, resource, body, status=200, headers=None):
+        '''
+        Apply latency, rate limit and ETag to a JSON response
+        '''
+        token = request.headers.get("Authorization", "").replace("token ", "").replace("bearer ", "")
+        bucket = self.get_bucket(token, resource)
+        headers = {**(headers or {}), **self.rate_limit_headers(bucket, resource)}
+        if bucket[0] <= 0:
+            self.stats["rate_limited"] += 1
+            return web.json_response({"message": "API rate limit exceeded"}, status=403, headers=headers)
+        if self.in_flight.get(token, 0) > self.secondary_concurrency:
+            self.stats["rate_limited"] += 1
+            headers["Retry-After"] = str(self.secondary_retry_after)
+            return web.json_response({"message": "You have exceeded a secondary rate limit"}, status=403, headers=headers)
+        content = json.dumps(body).encode()
+        etag = '"' + hashlib.md5(content).hexdigest() + '"'
+        headers["ETag"] = etag
+        if status == 200 and request.headers.get("If-None-Match") == etag: # 304 is not charged
+            self.stats["not_modified"] += 1
+            return web.Response(status=304, headers=headers)
+        bucket[0] -= 1
+        self.stats["charged"] += 1
+        headers.update(self.rate_limit_headers(bucket, resource))
+        self.stats["bytes"] += len(content)
+        return web.Response(body=content, status=status, headers=headers, content_type="application/json")
+
+    @web.middleware
+    async def middleware(self, request, handler):
+        # latency, in-flight counter and statistics of every request
+        token = request.headers.get("Authorization", "").replace("token ", "").replace("bearer ", "")
+        self.in_flight[token] = self.in_flight.get(token, 0) + 1
+        if self.stats["first_request"] is None:
+            self.stats["first_request"] = time.time()
+        self.stats["requests"] += 1
+        endpoint = request.match_info.route.name or request.path
+        self.stats["by_endpoint"][endpoint] = self.stats["by_endpoint"].get(endpoint, 0) + 1
+        try:
+            await asyncio.sleep(self.latency + self.rng.uniform(0, self.jitter))
+            return await handler(request)
+        finally:
+            self.in_flight[token] -= 1
+
+    # ---------------------- REST API ----------------------
+    def link_header(self, request, page, last_page):
+        if last_page <= 1:
+            return {}
+        def page_url(page_idx):
+            return str(request.url.update_query(page=page_idx))
+        links = []
+        if page < last_page:
+            links.append(f'<{page_url(page + 1)}>; rel="next"')
+            links.append(f'<{page_url(last_page)}>; rel="last"')
+        if page > 1:
+            links.append(f'<{page_url(1)}>; rel="first"')
+            links.append(f'<{page_url(page - 1)}>; rel="prev"')
+        return {"Link": ", ".join(links)}
+
+    async def search_repositories(self, request):
+        query = request.query.get("q", "")
+        lang = re.search(r"language:(\S+)", query)
+        repos = self.repos.get(lang.group(1).lower() if lang else "", [])
+        min_stars = re.search(r"stars:>(\d+)", query)
+        if min_stars:
+            repos = [repo for repo in repos if repo["stargazers_count"] > int(min_stars.group(1))]
+        star_range = re.search(r"stars:(\d+)\.\.(\d+)", query)
+        if star_range:
+            repos = [repo for repo in repos if int(star_range.group(1)) <= repo["stargazers_count"] <= int(star_range.group(2))]
+        created_range = re.search(r"created:(\S+)\.\.(\S+)", query)
+        if created_range:
+            repos = [repo for repo in repos if created_range.group(1) <= repo["created_at"][:10] <= created_range.group(2)]
+        repos = sorted(repos, key=lambda repo: -repo["stargazers_count"])
+        per_page = min(int(request.query.get("per_page", 30)), 100)
+        page = int(request.query.get("page", 1))
+        if (page - 1) * per_page >= 1000: # GitHub only serves the first 1000 search results
+            return self.respond(request, "search", {"message": "Only the first 1000 search results are available"}, status=422)
+        accessible = repos[:1000]
+        last_page = max((len(accessible) + per_page - 1) // per_page, 1)
+        items = accessible[(page - 1) * per_page: page * per_page]
+        body = {"total_count": len(repos), "incomplete_results": False, "items": items}
+        return self.respond(request, "search", body, headers=self.link_header(request, page, last_page))
+
+    async def list_commits(self, request):
+        full_name = f"{request.match_info['user']}/{request.match_info['proj']}"
+        commits = self.get_commits(full_name)
+        if commits is None:
+            return self.respond(request, "core", {"message": "Not Found"}, status=404)
+        since = request.query.get("since")
+        until = request.query.get("until")
+        if since is not None or until is not None:
+            commits = [commit for commit in commits
+                       if (since is None or commit["commit"]["committer"]["date"] >= since)
+                       and (until is None or commit["commit"]["committer"]["date"] <= until)]
+        per_page = min(int(request.query.get("per_page", 30)), 100)
+        page = int(request.query.get("page", 1))
+        last_page = max((len(commits) + per_page - 1) // per_page, 1)
+        items = commits[(page - 1) * per_page: page * per_page]
+        return self.respond(request, "core", items, headers=self.link_header(request, page, last_page))
+
+    async def get_commit(self, request):
+        full_name = f"{request.match_info['user']}/{request.match_info['proj']}"
+        commits = self.get_commits(full_name) or []
+        commit = next((commit for commit in commits if commit["sha"] == request.match_info["sha"]), None)
+        if commit is None:
+            return self.respond(request, "core", {"message": "No commit found for SHA"}, status=422)
+        git_path = os.path.join(self.data_dir, "git", full_name + ".git")
+        if "files" not in commit and os.path.exists(git_path):
+            commit = {**commit, "files": read_git_files(git_path, commit["sha"])}
+        return self.respond(request, "core", commit)
+
+    async def graphql(self, request):
+        # only the queries of 1_crawl.py:
+        # repository(...) { defaultBranchRef { target { ... on Commit { history(...) } } } }
+        # repository(...) { c0: object(oid: ...) { ... on Commit { author { user { login } } } } ... }
+        query = (await request.json())["query"]
+        data = {}
+        if "object(oid:" in query:
+            alias, owner, name = re.search(r'(\w+): repository\(owner: "([^"]+)", name: "([^"]+)"\)', query).groups()
+            commits = self.get_commits(f"{owner}/{name}")
+            if commits is None:
+                data[alias] = None
+                return self.respond(request, "graphql", {"data": data})
+            commits = {commit["sha"]: commit for commit in commits}
+            data[alias] = {}
+            for object_alias, oid, role in re.findall(r'(\w+): object\(oid: "([0-9a-f]+)"\) \{ \.\.\. on Commit \{ (author|committer)', query):
+                commit = commits.get(oid)
+                user = None if commit is None else commit[role]
+                data[alias][object_alias] = None if commit is None else \
+                    {role: {"user": None if user is None or user["type"] != "User" else {"login": user["login"]}}}
+            return self.respond(request, "graphql", {"data": data})
+        for alias, owner, name, args in re.findall(r'(\w+): repository\(owner: "([^"]+)", name: "([^"]+)"\).*?history\(([^)]*)\)', query):
+            commits = self.get_commits(f"{owner}/{name}")
+            if commits is None:
+                data[alias] = None
+                continue
+            since = re.search(r'since: "([^"]+)"', args)
+            until = re.search(r'until: "([^"]+)"', args)
+            commits = [commit for commit in commits
+                       if (since is None or commit["commit"]["committer"]["date"] >= since.group(1))
+                       and (until is None or commit["commit"]["committer"]["date"] <= until.group(1))]
+            first = int(re.search(r"first: (\d+)", args).group(1))
+            after = re.search(r'after: "(\d+)"', args)
+            start = int(after.group(1)) if after else 0
+            nodes = []
+            for commit in commits[start:start + first]:
+                def to_actor(user):
+                    return {"user": None if user is None or user["type"] != "User" else {"login": user["login"]}}
+                nodes.append({
+                    "oid": commit["sha"],
+                    "url": commit["html_url"],
+                    "message": commit["commit"]["message"],
+                    "committedDate": commit["commit"]["committer"]["date"],
+                    "author": to_actor(commit["author"]),
+                    "committer": to_actor(commit["committer"]),
+                    "parents": {"nodes": [{"oid": parent["sha"]} for parent in commit["parents"][:2]]}
+                })
+            data[alias] = {"defaultBranchRef": {"target": {"history": {
+                "pageInfo": {"hasNextPage": start + first < len(commits), "endCursor": str(start + first)},
+                "nodes": nodes
+            }}}}
+        return self.respond(request, "graphql", {"data": data})
+
+    # ---------------------- git smart-HTTP ----------------------
+    async def git_http_backend(self, request):
+        # delegate git clone / fetch to git http-backend (CGI), not rate limited
+        body = await request.read()
+        env = {
+            **os.environ,
+            "GIT_PROJECT_ROOT": os.path.join(self.data_dir, "git"),
+            "GIT_HTTP_EXPORT_ALL": "1",
+            "PATH_INFO": request.path,
+            "REQUEST_METHOD": request.method,
+            "QUERY_STRING": request.query_string,
+            "CONTENT_TYPE": request.headers.get("Content-Type", ""),
+            "CONTENT_LENGTH": str(len(body)),
+            "HTTP_CONTENT_ENCODING": request.headers.get("Content-Encoding", ""),
+            "GIT_PROTOCOL": request.headers.get("Git-Protocol", ""),
+            "REMOTE_ADDR": request.remote or ""
+        }
+        process = await asyncio.create_subprocess_exec("git", "http-backend", env=env, stdin=subprocess.PIPE,
+                                                       stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        stdout, _ = await process.communicate(body)
+        header_end = stdout.find(b"\r\n\r\n")
+        separator_len = 4
+        if header_end < 0:
+            header_end = stdout.find(b"\n\n")
+            separator_len = 2
+        status = 200
+        headers = {}
+        for line in stdout[:header_end].decode().splitlines():
+            key, value = line.split(":", 1)
+            if key.lower() == "status":
+                status = int(value.strip().split()[0])
+            else:
+                headers[key.strip()] = value.strip()
+        self.stats["git_bytes"] += len(stdout) - header_end - separator_len
+        return web.Response(body=stdout[header_end + separator_len:], status=status, headers=headers)
+
+    async def get_stats(self, request):
+        return web.json_response(self.stats)
+
+    def make_app(self):
+        app = web.Application(middlewares=[self.middleware], client_max_size=1024**3)
+        app.router.add_get("/search/repositories", self.search_repositories, name="search")
+        app.router.add_get("/repos/{user}/{proj}/commits", self.list_commits, name="commits")
+        app.router.add_get("/repos/{user}/{proj}/commits/{sha}", self.get_commit, name="commit")
+        app.router.add_post("/graphql", self.graphql, name="graphql")
+        app.router.add_get("/_stats", self.get_stats, name="stats")
+        app.router.add_route("*", "/{user}/{proj}.git/{path:.*}", self.git_http_backend, name="git")
+        return app
+
+    def start_in_thread(self, port=0):
+        '''
+        Serve in a daemon thread, return the base url, e.g. http://127.0.0.1:8000
+        '''
+        started = threading.Event()
+        def serve():
+            loop = asyncio.new_event_loop()
+            runner = web.AppRunner(self.make_app(), access_log=None)
+            loop.run_until_complete(runner.setup())
+            site = web.TCPSite(runner, "127.0.0.1", port)
+            loop.run_until_complete(site.start())
+            self.base_url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+            self.api_url = self.base_url
+            started.set()
+            loop.run_forever()
+        threading.Thread(target=serve, daemon=True).start()
+        started.wait()
+        return self.base_url
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--data-dir", default="./fake_github")
+    parser.add_argument("--langs", default="python")
+    parser.add_argument("--repo-num", type=int, default=20)
+    parser.add_argument("--commit-num", type=int, default=300)
+    parser.add_argument("--record-dir", default=None)
+    parser.add_argument("--latency", type=float, default=0.05)
+    args = parser.parse_args()
+    server = FakeGithub(args.data_dir, args.langs.split(","), args.repo_num, args.commit_num,
+                        record_dir=args.record_dir, latency=args.latency)
+    print(f"==> Fake GitHub serving at {server.start_in_thread(args.port)}")
+    threading.Event().wait()
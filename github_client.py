@@ -0,0 +1,67 @@
+# This script is an asyncio based GitHub API client used by 1_crawl.py
+# 1. All requests share one keep-alive aiohttp session, so TCP/TLS connections are reused across requests
+# 2. The number of in-flight requests of each token is bounded by a semaphore
+# 3. Responses are transparently gzip decompressed by aiohttp
+# 4. Besides GET requests of the REST API, it also sends POST requests of the GraphQL API
+import asyncio
+import random
+import aiohttp
+
+from user_agent_pool import user_agents
+
+class GithubClient:
+    def __init__(self, max_concurrency_per_token=8, timeout=40):
+        self.max_concurrency_per_token = max_concurrency_per_token
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        # the sync wrapper runs every coroutine on this loop, the session is bound to it
+        self.loop = asyncio.new_event_loop()
+        self.session = None
+        self.semaphores = {}
+        self.headers = {}
+
+    def get_headers(self, token):
+        # build the header dict once per token instead of once per request
+        if token not in self.headers:
+            self.headers[token] = {
+                'User-Agent': random.choice(user_agents),
+                'Accept': 'application/vnd.github+json',
+                'Authorization': 'token ' + token,
+                'Accept-Encoding': 'gzip, deflate',
+                'Accept-Language': 'zh-CN,zh;q=0.8'
+            }
+        return self.headers[token]
+
+    async def get_session(self):
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=0, keepalive_timeout=60, ttl_dns_cache=300)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self.session
+
+    async def get(self, request_url, params=None, token=None, proxy=None, headers=None):
+        return await self.request("GET", request_url, params, token, proxy, headers)
+
+    async def request(self, method, request_url, params=None, token=None, proxy=None, headers=None, json_body=None):
+        '''
+        Send 1 request with the given token, return (status code, response headers, content)
+        '''
+        session = await self.get_session()
+        if token not in self.semaphores:
+            self.semaphores[token] = asyncio.Semaphore(self.max_concurrency_per_token)
+        if params is not None:
+            params = {key: str(value) for key, value in params.items()}
+        request_headers = self.get_headers(token)
+        if headers:
+            request_headers = {**request_headers, **headers}
+        async with self.semaphores[token]:
+            async with session.request(method, request_url, params=params, headers=request_headers,
+                                       proxy=proxy, json=json_body) as r:
+                content = await r.read()
+                return r.status, r.headers, content
+
+    def run(self, coro):
+        # sync wrapper, used by the blocking call sites
+        return self.loop.run_until_complete(coro)
+
+    def close(self):
+        if self.session is not None and not self.session.closed:
+            self.run(self.session.close())
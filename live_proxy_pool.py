@@ -0,0 +1,130 @@
+# This script keeps a live, health scored proxy pool for the GitHub client of 1_crawl.py
+# 1. Every request reports its proxy's latency and success, the score of a proxy is success rate^2 / latency
+# 2. A proxy is picked randomly, weighted by its score. The direct connection is also a candidate,
+#    so when every proxy is bad, requests go direct
+# 3. After several failures in a row, the circuit of a proxy opens and it is not picked until a cooldown passes,
+#    then 1 trial request decides whether it closes again or opens with a longer cooldown
+# 4. In the background, new candidates are loaded from the sources (e.g. the file written by proxy.py),
+#    validated by a probe request, and added to the pool
+import os
+import ast
+import time
+import random
+import asyncio
+import aiohttp
+
+DIRECT = "direct" # the candidate that does not use any proxy
+PROBE_URL = "https://github.com/robots.txt"
+
+def load_proxy_file(path):
+    # parse the proxy list written by proxy.py: proxy_list = ['ip:port', ...]
+    if not os.path.exists(path):
+        return []
+    with open(path, "r") as f:
+        content = f.read()
+    return list(ast.literal_eval(content[content.index("["):]))
+
+class ProxyState:
+    def __init__(self, latency=1.0, success=0.5):
+        self.latency = latency # EWMA of request latency, in seconds
+        self.success = success # EWMA of success rate
+        self.consecutive_failures = 0
+        self.open_times = 0 # how many times the circuit has opened, decides the cooldown
+        self.open_until = 0 # the circuit is open before this time
+
+    def score(self):
+        return self.success ** 2 / (self.latency + 0.1) + 1e-6 # never 0, random.choices needs a positive total weight
+
+class ProxyPool:
+    def __init__(self, sources, alpha=0.2, max_failures=3, cooldown=60, max_cooldown=3600, refresh_interval=600):
+        '''
+        sources: functions that return a list of 'ip:port' candidates
+        '''
+        self.sources = sources
+        self.alpha = alpha
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.refresh_interval = refresh_interval
+        self.proxies = {DIRECT: ProxyState(success=1.0)}
+        self.rejected = {} # candidates failing the probe are not probed again within max_cooldown
+        self.refresh_task = None
+
+    def choose(self):
+        '''
+        Return the proxy url to use, or None for the direct connection
+        '''
+        now = time.time()
+        candidates = [(proxy, state) for proxy, state in self.proxies.items() if state.open_until <= now]
+        if len(candidates) == 0:
+            return None
+        proxy, _ = random.choices(candidates, weights=[state.score() for _, state in candidates])[0]
+        return None if proxy == DIRECT else "http://" + proxy
+
+    def report(self, proxy_url, ok, latency):
+        proxy = DIRECT if proxy_url is None else proxy_url[len("http://"):]
+        state = self.proxies.get(proxy)
+        if state is None: # removed while the request is in flight
+            return
+        state.success = (1 - self.alpha) * state.success + self.alpha * (1.0 if ok else 0.0)
+        if ok:
+            state.latency = (1 - self.alpha) * state.latency + self.alpha * latency
+            state.consecutive_failures = 0
+            state.open_times = 0
+            return
+        state.consecutive_failures += 1
+        if proxy != DIRECT and state.consecutive_failures >= self.max_failures:
+            # open the circuit, the cooldown doubles every time it opens again
+            state.open_until = time.time() + min(self.cooldown * 2 ** state.open_times, self.max_cooldown)
+            state.open_times += 1
+            state.consecutive_failures = self.max_failures - 1 # half open: 1 more failure opens it again
+            if state.open_times > 6: # keeps failing for hours, drop it
+                del self.proxies[proxy]
+
+    async def probe(self, session, proxy):
+        start = time.time()
+        try:
+            async with session.get(PROBE_URL, proxy="http://" + proxy) as r:
+                await r.read()
+                if r.status == 200:
+                    return time.time() - start
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+            pass
+        return None
+
+    async def refresh(self):
+        # validate the new candidates, only those answering the probe join the pool
+        candidates = set()
+        for source in self.sources:
+            candidates.update(source())
+        now = time.time()
+        new_candidates = [proxy for proxy in candidates
+                          if proxy not in self.proxies and self.rejected.get(proxy, 0) + self.max_cooldown < now]
+        if len(new_candidates) == 0:
+            return
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10)) as session:
+            latencies = await asyncio.gather(*[self.probe(session, proxy) for proxy in new_candidates])
+        for proxy, latency in zip(new_candidates, latencies):
+            if latency is not None:
+                self.proxies[proxy] = ProxyState(latency=latency, success=1.0)
+            else:
+                self.rejected[proxy] = now
+        print(f"==> Proxy pool: {len(self.proxies) - 1} live proxies")
+
+    async def refresh_forever(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                print(f"==> Proxy pool refresh failed: {e}")
+            await asyncio.sleep(self.refresh_interval)
+
+    def start_refresh(self):
+        # must be called from the running event loop, the refresh runs whenever the loop runs
+        if self.refresh_task is None or self.refresh_task.done():
+            self.refresh_task = asyncio.ensure_future(self.refresh_forever())
+
+    def stop_refresh(self):
+        if self.refresh_task is not None:
+            self.refresh_task.cancel()
+            self.refresh_task = None
@@ -7,7 +7,7 @@
 @software: PyCharm
 @file: main.py
 @time: 2019/2/28 17:31
-@desc: A spider used to scrape proxy pool
+@desc: A spider used to scrape proxy pool, only the proxies that pass validation are written
 """
 import codecs
 import random
@@ -25,6 +25,7 @@ monkey.patch_all()
 class ProxySpider(object):
     def __init__(self, filename):
         self.url = "https://www.kuaidaili.com/free/inha/"
+        self.validate_url = "https://github.com/robots.txt" # the crawler requests GitHub over https
         self.filename = filename
         self.proxies = []
         self.f = codecs.open(self.filename, "w", "utf-8")
@@ -52,11 +53,22 @@ class ProxySpider(object):
             i = pq(item)
             ip = i("td")[0].text
             port = i("td")[1].text
+            if not self.validate("{}:{}".format(ip, port)):
+                continue
             line = "'{}:{}',\n".format(ip, port)
             self.proxies.append(line)
             print(line)
             self.f.write(line)
 
+    def validate(self, proxy):
+        # the proxy must be able to tunnel https requests to GitHub
+        try:
+            r = requests.get(self.validate_url, headers=self.headers,
+                             proxies={"http": "http://" + proxy, "https": "http://" + proxy}, timeout=5)
+            return r.status_code == 200
+        except requests.RequestException:
+            return False
+
     def run(self):
         self.f.write("proxy_list = [\n")
         p = Pool(20)
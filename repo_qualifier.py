@@ -0,0 +1,74 @@
+# This script estimates how many commits of a repo can pass 3_clean_edit_info.git_parse_diff, before the repo is cloned
+# 1. A sample of the repo's candidate commits (those passing 2_clean_commit_info.commit_filter) is requested from the commit API,
+#    whose response lists the changed files of the commit with their patches
+# 2. Each sampled commit is checked by the rules of git_parse_diff that only need the file list and the patches:
+#    >= 2 files, no renamed file, only source files, no added / removed / fully rewritten file, ascii edits,
+#    3 ~ 15 edits, each edit <= 15 lines
+# 3. The estimated yield of a repo = the number of candidate commits * the passing rate of the sample
+import os
+
+SOURCE_EXTENSIONS = ['.go', '.js', '.java', '.py', '.ts', '.tsx'] # the white list of 3_clean_edit_info.detect_extension
+
+def get_extension(file_name):
+    # same as 3_clean_edit_info.detect_extension, a.b.c -> .b.c
+    file_name_elements = os.path.basename(file_name).split('.')
+    if len(file_name_elements) == 2:
+        return '.'+file_name_elements[-1]
+    return '.'+'.'.join(file_name_elements[-2:])
+
+def count_edits(patch):
+    '''
+    Return the edits of a unified diff patch, 1 edit = a run of consecutive removed / added lines, as [(removed, added), ...]
+    '''
+    edits = []
+    removed, added = 0, 0
+    for line in patch.splitlines():
+        if line.startswith('-'):
+            removed += 1
+        elif line.startswith('+'):
+            added += 1
+        elif line.startswith('\\'): # \ No newline at end of file
+            continue
+        else:
+            if removed + added > 0:
+                edits.append((removed, added))
+            removed, added = 0, 0
+    if removed + added > 0:
+        edits.append((removed, added))
+    return edits
+
+def check_commit_files(files):
+    '''
+    files: the "files" of a commit object of the GitHub API.
+    Raise ValueError labeled by the rule of 3_clean_edit_info.git_parse_diff if the commit would be filtered out by it
+    '''
+    if len(set(file['filename'] for file in files)) < 2:
+        raise ValueError('11 Contain edit on less than 2 files')
+    edit_num = 0
+    for file in files:
+        if file['status'] == 'renamed':
+            raise ValueError(f"2 Contain edit changes file name: {file.get('previous_filename')} -> {file['filename']}")
+        if get_extension(file['filename']) not in SOURCE_EXTENSIONS:
+            raise ValueError('3 Contain edit on non-source files')
+        patch = file.get('patch')
+        if patch is None: # binary file, or the diff is too large to be shown
+            raise ValueError('4 Edit fail to match @@ -xx,xx +xx,xx @@')
+        if not patch.isascii():
+            raise ValueError('5 Edit/file contain non-ascii char')
+        # an added / removed file, or a file without any unchanged line, has a snapshot of only edits
+        if file['status'] in ['added', 'removed'] or \
+                not any(line.startswith(' ') for line in patch.splitlines()):
+            raise ValueError('9 file contain only edit')
+        for removed, added in count_edits(patch):
+            if removed > 15 or added > 15:
+                raise ValueError(f'7 Edit longer than 15 lines, before: {removed} lines, after: {added} lines')
+            edit_num += 1
+    if edit_num > 15:
+        raise ValueError(f'6 Commit contain more than 15 hunk, hunk num >= {edit_num}')
+    if edit_num < 3:
+        raise ValueError(f'6 Commit contain less than 3 hunk, hunk num: {edit_num}')
+
+def estimate_yield(candidate_num, sample_num, passed_num):
+    if sample_num == 0:
+        return 0.0
+    return candidate_num * passed_num / sample_num
@@ -0,0 +1,95 @@
+# This script decides where the local clone of a repo lives, and where it can be seeded from
+# 1. A repo is cloned to {ROOT_PATH}/repos/{owner}/{name}, so projects with the same name from different owners do not collide.
+#    Clones of the old layout {ROOT_PATH}/repos/{name} are moved by migrate_legacy_repos, which 1_crawl.crawl runs before any clone:
+#    an owner directory may have the name of an old clone. Until then, get_repo_path still finds them
+# 2. Instead of GitHub, a repo can be seeded from a local directory of bare mirrors ({mirror_dir}/{owner}/{name}.git)
+#    or of git bundles ({bundle_dir}/{owner}/{name}.bundle), e.g. a store shared by all workers
+import os
+import re
+
+def get_full_name(commit_url):
+    # https://github.com/{owner}/{name}/commit/{sha} -> {owner}/{name}
+    return "/".join(commit_url.split('/')[-4:-2])
+
+def get_config_path(repo_path):
+    # the git config of a clone (work tree) or a bare mirror, None if the directory is not a repo, e.g. an owner directory
+    if os.path.isfile(os.path.join(repo_path, '.git', 'config')):
+        return os.path.join(repo_path, '.git', 'config')
+    if os.path.isfile(os.path.join(repo_path, 'config')) and os.path.isfile(os.path.join(repo_path, 'HEAD')):
+        return os.path.join(repo_path, 'config')
+    return None
+
+def get_origin_full_name(repo_path):
+    # the {owner}/{name} of the GitHub repo a clone is cloned from, None if it is not a repo or not cloned from GitHub
+    config_path = get_config_path(repo_path)
+    if config_path is None:
+        return None
+    with open(config_path, 'r') as f:
+        match = re.search(r'\[remote "origin"\][^\[]*?url\s*=\s*\S*github\.com[/:]([^/\s]+)/([^/\s]+?)(?:\.git)?/?\s*$',
+                          f.read(), re.MULTILINE)
+    return "/".join(match.groups()) if match is not None else None
+
+def get_legacy_repo_path(root_path, full_name):
+    '''
+    Return the clone of this repo in the old layout {root_path}/repos/{name}, or None if there is none.
+    A clone of another owner's project with the same name is not returned
+    '''
+    repo_path = os.path.normpath(os.path.join(root_path, 'repos', full_name.split('/')[1]))
+    return repo_path if get_origin_full_name(repo_path) == full_name else None
+
+def migrate_legacy_repos(root_path):
+    '''
+    Move every clone of the old layout {root_path}/repos/{name} to {root_path}/repos/{owner}/{name}, return the number of moved clones.
+    All of them are moved aside to {root_path}/repos/.legacy first, so that no clone is moved into the work tree of another
+    (e.g. repos/foo, a clone of x/foo, and repos/bar, a clone of foo/bar). A migration interrupted halfway is finished by the next one
+    '''
+    repos_dir = os.path.join(root_path, 'repos')
+    staging_dir = os.path.join(repos_dir, '.legacy')
+    if not os.path.isdir(repos_dir):
+        return 0
+    for name in sorted(os.listdir(repos_dir)):
+        repo_path = os.path.join(repos_dir, name)
+        if name == '.legacy' or get_config_path(repo_path) is None: # an owner directory of the new layout
+            continue
+        if get_origin_full_name(repo_path) is None:
+            print(f"==> {repo_path} is not cloned from GitHub, it is not migrated")
+            continue
+        os.makedirs(staging_dir, exist_ok=True)
+        os.rename(repo_path, os.path.join(staging_dir, name))
+    if not os.path.isdir(staging_dir):
+        return 0
+    moved_num = 0
+    for name in sorted(os.listdir(staging_dir)):
+        legacy_repo_path = os.path.join(staging_dir, name)
+        full_name = get_origin_full_name(legacy_repo_path)
+        if full_name is None or os.path.exists(os.path.join(repos_dir, full_name)):
+            print(f"==> {legacy_repo_path} is not migrated, it is not cloned from GitHub or {full_name} has been cloned")
+            continue
+        repo_path = os.path.join(repos_dir, full_name)
+        os.makedirs(os.path.dirname(repo_path), exist_ok=True)
+        os.rename(legacy_repo_path, repo_path)
+        moved_num += 1
+    if len(os.listdir(staging_dir)) == 0:
+        os.rmdir(staging_dir)
+    return moved_num
+
+def get_repo_path(root_path, full_name):
+    '''
+    Return the path of the local clone of this repo, {root_path}/repos/{owner}/{name} unless only an old layout clone exists
+    '''
+    repo_path = os.path.normpath(os.path.join(root_path, 'repos', full_name))
+    if not os.path.exists(repo_path):
+        legacy_repo_path = get_legacy_repo_path(root_path, full_name)
+        if legacy_repo_path is not None:
+            return legacy_repo_path
+    return repo_path
+
+def get_seed_source(full_name, mirror_dir=None, bundle_dir=None):
+    '''
+    Return the local mirror or bundle this repo can be cloned from, or None
+    '''
+    if mirror_dir is not None and os.path.isdir(os.path.join(mirror_dir, full_name + '.git')):
+        return os.path.join(mirror_dir, full_name + '.git')
+    if bundle_dir is not None and os.path.isfile(os.path.join(bundle_dir, full_name + '.bundle')):
+        return os.path.join(bundle_dir, full_name + '.bundle')
+    return None
@@ -0,0 +1,106 @@
+# This script is a persistent HTTP response cache used by 1_crawl.py
+# 1. Responses are stored in a sqlite file, keyed by url + params, together with their ETag / Last-Modified
+# 2. Cached requests are re-sent as conditional requests, GitHub does not charge 304 responses to the rate limit
+# 3. When the cache exceeds max_bytes, the least recently used responses are evicted
+# 4. In offline mode (1_crawl.OFFLINE), 1_crawl.request_async only replays the cached responses, nothing is sent to GitHub
+import time
+import json
+import sqlite3
+import hashlib
+
+SCHEMA_VERSION = 1 # 1: the link column
+
+class ResponseCache:
+    def __init__(self, path, max_bytes=20*1024**3):
+        self.path = path
+        self.max_bytes = max_bytes
+        # several crawler processes may share the cache, wait for each other's writes
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS response (
+                key TEXT PRIMARY KEY,
+                url TEXT,
+                etag TEXT,
+                last_modified TEXT,
+                link TEXT,
+                content BLOB,
+                size INTEGER,
+                last_access REAL
+            )""")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS response_last_access ON response (last_access)")
+        self.migrate()
+        self.conn.commit()
+        # kept in memory so that we do not sum up the whole table after every put
+        self.total_size = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM response").fetchone()[0]
+
+    def migrate(self):
+        # upgrade a cache written by an older version, columns added later come last
+        if self.conn.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+            return
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(response)")]
+        if "link" not in columns:
+            self.conn.execute("ALTER TABLE response ADD COLUMN link TEXT")
+        self.conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    @staticmethod
+    def get_key(request_url, params=None):
+        params = {key: str(value) for key, value in (params or {}).items()}
+        return hashlib.sha1((request_url + json.dumps(params, sort_keys=True)).encode()).hexdigest()
+
+    def get(self, request_url, params=None):
+        '''
+        Return (etag, last_modified, content, link) of the cached response, or None if not cached
+        '''
+        key = self.get_key(request_url, params)
+        row = self.conn.execute("SELECT etag, last_modified, content, link FROM response WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        self.conn.execute("UPDATE response SET last_access = ? WHERE key = ?", (time.time(), key))
+        self.conn.commit()
+        return row
+
+    def get_conditional_headers(self, cached):
+        if cached is None:
+            return None
+        etag, last_modified, _, _ = cached
+        headers = {}
+        if etag is not None:
+            headers['If-None-Match'] = etag
+        if last_modified is not None:
+            headers['If-Modified-Since'] = last_modified
+        return headers
+
+    def put(self, request_url, params, headers, content):
+        etag = headers.get('ETag')
+        last_modified = headers.get('Last-Modified')
+        if etag is None and last_modified is None: # can not be revalidated, no need to cache
+            return
+        key = self.get_key(request_url, params)
+        row = self.conn.execute("SELECT size FROM response WHERE key = ?", (key,)).fetchone()
+        # the pagination Link header is kept so that cached first pages still tell the number of pages
+        self.conn.execute("INSERT OR REPLACE INTO response (key, url, etag, last_modified, link, content, size, last_access) "
+                          "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                          (key, request_url, etag, last_modified, headers.get('Link'), content, len(content), time.time()))
+        self.conn.commit()
+        self.total_size += len(content) - (row[0] if row else 0)
+        if self.total_size > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        # other processes may have changed the cache, recount before evicting
+        total_size = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM response").fetchone()[0]
+        self.total_size = total_size
+        if total_size <= self.max_bytes:
+            return
+        # evict the least recently used responses until the cache shrinks to 90% of max_bytes
+        to_free = total_size - int(self.max_bytes * 0.9)
+        keys = []
+        for key, size in self.conn.execute("SELECT key, size FROM response ORDER BY last_access"):
+            keys.append((key,))
+            to_free -= size
+            if to_free <= 0:
+                break
+        self.conn.executemany("DELETE FROM response WHERE key = ?", keys)
+        self.conn.commit()
+        self.total_size = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM response").fetchone()[0]
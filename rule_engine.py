@@ -0,0 +1,111 @@
+# This script is a small rule engine for the filters of the pipeline, e.g. 2_clean_commit_info.commit_filter
+# 1. A rule is a labeled check, the engine applies the rules one by one and stops at the first failure,
+#    raising ValueError('{label} {description}') as the hand written filters did
+# 2. The time spent and the rejections of each rule are recorded
+# 3. Every reorder_every applications, the rules are reordered by measured cost / rejection rate, so cheap rules that
+#    reject a lot run first. The verdict of an item never depends on the order, only which failed rule is reported
+# 4. Each rule has a hash of its definition (label, description, source of the check and the patterns / constants it reads),
+#    verdicts of a rule can be cached under this hash (check verdict_cache.py) and reused until the rule is changed
+import re
+import time
+import inspect
+import hashlib
+
+def get_rule_hash(label, description, check):
+    try:
+        source = inspect.getsource(check)
+    except (OSError, TypeError): # defined in an interactive session, or not a plain function
+        source = repr(check)
+    parts = [label, description, source]
+    # the module level patterns / constants the check reads, e.g. IMPERATIVE_PATTERN of 2_clean_commit_info
+    code = getattr(check, '__code__', None)
+    for name in (code.co_names if code is not None else []):
+        value = getattr(check, '__globals__', {}).get(name)
+        if isinstance(value, re.Pattern):
+            parts.append(f'{name}={value.pattern!r}/{value.flags}')
+        elif isinstance(value, (str, int, float, bool, tuple, frozenset)):
+            parts.append(f'{name}={value!r}')
+    return hashlib.sha1('\0'.join(parts).encode()).hexdigest()[:16]
+
+class Rule:
+    def __init__(self, label, description, check):
+        '''
+        check: a function taking the item, returning True if the item passes this rule
+        '''
+        self.label = label
+        self.description = description
+        self.check = check
+        self.hash = get_rule_hash(label, description, check)
+        self.evaluated = 0
+        self.rejected = 0
+        self.cached = 0 # verdicts reused from a cache instead of evaluated
+        self.seconds = 0.0
+
+    def priority(self):
+        # the expected cost of this rule per rejection, lower runs first. Rules not measured yet run first to get measured
+        if self.evaluated == 0:
+            return 0.0
+        return (self.seconds / self.evaluated) / ((self.rejected + 1) / (self.evaluated + 2))
+
+class RuleEngine:
+    def __init__(self, rules, reorder_every=1000):
+        self.rules = list(rules) # in the initial order, cheap rules first
+        self.reorder_every = reorder_every
+        self.applied = 0
+
+    def apply(self, item, verdicts=None):
+        '''
+        Raise ValueError labeled by the first rule the item fails
+        verdicts: the cached verdicts of this item {rule hash: passed}, if given a rule rejecting the item is reported
+        without evaluating any rule, otherwise only the rules not in it are evaluated, and their verdicts are added to it
+        '''
+        self.applied += 1
+        if self.reorder_every is not None and self.applied % self.reorder_every == 0:
+            self.rules.sort(key=lambda rule: rule.priority())
+        if verdicts is not None:
+            for rule in self.rules:
+                if verdicts.get(rule.hash) is False:
+                    rule.cached += 1
+                    raise ValueError(f'{rule.label} {rule.description}')
+        for rule in self.rules:
+            if verdicts is not None and rule.hash in verdicts:
+                rule.cached += 1
+                continue
+            start = time.perf_counter()
+            passed = rule.check(item)
+            rule.seconds += time.perf_counter() - start
+            rule.evaluated += 1
+            if verdicts is not None:
+                verdicts[rule.hash] = bool(passed)
+            if not passed:
+                rule.rejected += 1
+                raise ValueError(f'{rule.label} {rule.description}')
+        return True
+
+    def stats(self):
+        return {rule.label: {"description": rule.description, "evaluated": rule.evaluated, "rejected": rule.rejected,
+                             "cached": rule.cached, "seconds": rule.seconds} for rule in self.rules}
+
+    def pop_stats(self):
+        # return the stats and start counting from 0, used by worker processes to report their share
+        stats = self.stats()
+        for rule in self.rules:
+            rule.evaluated, rule.rejected, rule.cached, rule.seconds = 0, 0, 0, 0.0
+        return stats
+
+    def merge_stats(self, stats):
+        # add the stats of the same rules applied in another process
+        rules = {rule.label: rule for rule in self.rules}
+        for label, rule_stats in stats.items():
+            rules[label].evaluated += rule_stats["evaluated"]
+            rules[label].rejected += rule_stats["rejected"]
+            rules[label].cached += rule_stats["cached"]
+            rules[label].seconds += rule_stats["seconds"]
+
+    def summary(self):
+        lines = ['Rule statistics (in the current order):']
+        for rule in self.rules:
+            mean = rule.seconds / rule.evaluated * 1e6 if rule.evaluated > 0 else 0.0
+            lines.append(f'Rule {rule.label} {rule.description}: evaluated {rule.evaluated}, rejected {rule.rejected}, '
+                         f'cached {rule.cached}, {rule.seconds:.3f}s in total, {mean:.1f}us per item')
+        return "\n".join(lines)
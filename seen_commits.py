@@ -0,0 +1,61 @@
+# This script is a persistent sha level seen-set of commits, shared by 1_crawl, 2_clean_commit_info and 3_clean_edit_info of every language
+# 1. The first html_url claiming a sha owns it, the same sha from any other repo (fork, mirror, vendored copy) is a duplicate
+# 2. Claims are idempotent, a rerun of any stage gets the same answer for the same html_url
+# 3. It is a sqlite file at {ROOT_PATH}/commit_info/seen_commits.sqlite, several processes may share it
+# 4. The stages number their rules independently, a duplicate is rule 8 of 2_clean_commit_info and rule 15 of 3_clean_edit_info,
+#    both reported as DUPLICATE_DESCRIPTION
+import os
+import sqlite3
+
+DUPLICATE_DESCRIPTION = "Duplicate of a commit in another repo / language"
+
+def get_seen_commits_path(root_path):
+    return os.path.join(root_path, 'commit_info', 'seen_commits.sqlite')
+
+def is_fork_or_mirror(repo):
+    # from the repo information of the search API
+    return bool(repo.get("fork")) or bool(repo.get("mirror_url"))
+
+class SeenCommits:
+    def __init__(self, path, commit_every=1000):
+        self.path = path
+        self.commit_every = commit_every # claims are committed in batches, so other processes are not blocked for long
+        self.pending = 0
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS seen (
+                sha TEXT PRIMARY KEY,
+                html_url TEXT
+            ) WITHOUT ROWID""")
+        self.conn.commit()
+
+    def claim(self, sha, html_url):
+        '''
+        Return True if html_url owns this sha (it is the first one claiming it), False if it is a duplicate
+        '''
+        self.conn.execute("INSERT OR IGNORE INTO seen (sha, html_url) VALUES (?, ?)", (sha, html_url))
+        owner = self.conn.execute("SELECT html_url FROM seen WHERE sha = ?", (sha,)).fetchone()[0]
+        self.pending += 1
+        if self.pending >= self.commit_every:
+            self.flush()
+        return owner == html_url
+
+    def filter_commits(self, commits):
+        # keep the commits (API commit objects) that are not duplicates, a sha listed twice is kept once
+        unique_commits = []
+        shas = set()
+        for commit in commits:
+            if commit['sha'] not in shas and self.claim(commit['sha'], commit['html_url']):
+                unique_commits.append(commit)
+                shas.add(commit['sha'])
+        self.flush()
+        return unique_commits
+
+    def flush(self):
+        self.conn.commit()
+        self.pending = 0
+
+    def close(self):
+        self.flush()
+        self.conn.close()
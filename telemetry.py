@@ -0,0 +1,146 @@
+# This script collects the metrics of 1_crawl.py, so that a slow crawl can be explained
+# 1. Counters (e.g. retries by status code, bytes), gauges (e.g. quota remaining of each token)
+#    and histograms (e.g. request latency, clone duration), each may have labels
+# 2. They are flushed periodically to a JSON file and a Prometheus textfile (for the textfile collector of node_exporter),
+#    and summarized at the end of a run
+import os
+import json
+import time
+import asyncio
+
+# upper bounds of histogram buckets, in seconds
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+DURATION_BUCKETS = [1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600]
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # the last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        idx = 0
+        while idx < len(self.buckets) and value > self.buckets[idx]:
+            idx += 1
+        self.counts[idx] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        # estimated by linear interpolation inside the bucket, like histogram_quantile of Prometheus
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for idx, count in enumerate(self.counts):
+            if cumulative + count >= rank and count > 0:
+                if idx == len(self.buckets): # +Inf bucket, the best we know is the largest bound
+                    return self.buckets[-1]
+                lower = self.buckets[idx - 1] if idx > 0 else 0.0
+                return lower + (self.buckets[idx] - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+def format_labels(labels):
+    if len(labels) == 0:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+class Metrics:
+    def __init__(self):
+        self.counters = {} # (name, labels) -> value, labels is a sorted tuple of (key, value)
+        self.gauges = {}
+        self.histograms = {}
+        self.start_time = time.time()
+        self.flush_task = None
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        if key not in self.histograms:
+            self.histograms[key] = Histogram(buckets)
+        self.histograms[key].observe(value)
+
+    def to_json(self):
+        def dump(metrics, value_of):
+            return [{"name": name, "labels": dict(labels), **value_of(value)} for (name, labels), value in sorted(metrics.items())]
+        return {
+            "time": time.time(),
+            "elapsed": time.time() - self.start_time,
+            "counters": dump(self.counters, lambda value: {"value": value}),
+            "gauges": dump(self.gauges, lambda value: {"value": value}),
+            "histograms": dump(self.histograms, lambda histogram: {"buckets": histogram.buckets, "counts": histogram.counts,
+                                                                    "count": histogram.count, "sum": histogram.sum})
+        }
+
+    def to_prometheus(self):
+        lines = []
+        typed = set()
+        def declare(name, metric_type):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {metric_type}")
+        for (name, labels), value in sorted(self.counters.items()):
+            declare(name, "counter")
+            lines.append(f"{name}{format_labels(labels)} {value}")
+        for (name, labels), value in sorted(self.gauges.items()):
+            declare(name, "gauge")
+            lines.append(f"{name}{format_labels(labels)} {value}")
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            declare(name, "histogram")
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + ["+Inf"], histogram.counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{format_labels(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{name}_sum{format_labels(labels)} {histogram.sum}")
+            lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def flush(self, json_path=None, prometheus_path=None):
+        # write to a temporary file first, readers never see a half written file
+        for path, content in [(json_path, lambda: json.dumps(self.to_json(), indent=4)), (prometheus_path, self.to_prometheus)]:
+            if path is None:
+                continue
+            with open(path + '.tmp', 'w') as f:
+                f.write(content())
+            os.replace(path + '.tmp', path)
+
+    async def flush_forever(self, interval, json_path, prometheus_path):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.flush(json_path, prometheus_path)
+            except OSError as e:
+                print(f"==> Metrics flush failed: {e}")
+
+    def start_flush(self, interval, json_path, prometheus_path):
+        # must be called from the running event loop, the flush runs whenever the loop runs
+        if self.flush_task is None or self.flush_task.done():
+            self.flush_task = asyncio.ensure_future(self.flush_forever(interval, json_path, prometheus_path))
+
+    def stop_flush(self):
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            self.flush_task = None
+
+    def summary(self):
+        '''
+        Return the end-of-run summary, 1 line per metric (histograms: count, mean, p50, p95)
+        '''
+        lines = [f"==> Metrics after {time.time() - self.start_time:.1f} seconds:"]
+        for (name, labels), value in sorted(self.counters.items()):
+            lines.append(f"    {name}{format_labels(labels)}: {value:g}")
+        for (name, labels), value in sorted(self.gauges.items()):
+            lines.append(f"    {name}{format_labels(labels)}: {value:g}")
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            mean = histogram.sum / histogram.count if histogram.count > 0 else 0.0
+            lines.append(f"    {name}{format_labels(labels)}: count {histogram.count}, mean {mean:.3f}s, "
+                         f"p50 {histogram.quantile(0.5):.3f}s, p95 {histogram.quantile(0.95):.3f}s")
+        return "\n".join(lines)
@@ -0,0 +1,144 @@
+# This script schedules the GitHub tokens used by 1_crawl.py
+# 1. Every response updates the budget of its token from X-RateLimit-Remaining / X-RateLimit-Reset / Retry-After
+# 2. Every request is sent with the token that has the most budget left
+# 3. The budget of all tokens is kept in a json file guarded by a file lock,
+#    so several crawler processes share one view of the quota. The calls block on the lock and the file,
+#    asyncio code runs them in a thread (asyncio.to_thread), they are thread safe
+import os
+import json
+import time
+import fcntl
+import hashlib
+import threading
+from contextlib import contextmanager
+
+# the budget of a token before we have seen any response of it
+DEFAULT_LIMIT = {
+    "core": 5000,
+    "search": 30,
+    "graphql": 5000
+}
+# the length of the rate limit window, the budget is reset this long after it is first used unless a response tells the reset
+WINDOW_SECONDS = {
+    "core": 3600,
+    "search": 60,
+    "graphql": 3600
+}
+
+def get_resource(request_url):
+    # GitHub counts search, graphql and the other REST endpoints in different buckets
+    if "/search/" in request_url:
+        return "search"
+    if request_url.rstrip("/").endswith("/graphql"):
+        return "graphql"
+    return "core"
+
+class TokenScheduler:
+    def __init__(self, tokens, state_path=None):
+        self.tokens = tokens
+        self.state_path = state_path
+        # the raw token never goes into the state file
+        self.keys = {token: hashlib.sha1(token.encode()).hexdigest()[:12] for token in tokens}
+        self.state = {}
+        self.lock = threading.Lock() # the threads of this process share self.state
+
+    @contextmanager
+    def locked_state(self):
+        '''
+        Load the shared state under an exclusive file lock, write it back when leaving
+        '''
+        if self.state_path is None:
+            with self.lock:
+                yield self.state
+            return
+        with self.lock, open(self.state_path + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                if os.path.exists(self.state_path):
+                    with open(self.state_path, "r") as f:
+                        try:
+                            self.state = json.load(f)
+                        except json.JSONDecodeError:
+                            self.state = {}
+                yield self.state
+                tmp_path = self.state_path + ".tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump(self.state, f)
+                os.replace(tmp_path, self.state_path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def get_budget(self, state, token, resource, now):
+        bucket = state.setdefault(self.keys[token], {}).setdefault(resource, {})
+        if bucket.get("reset", 0) <= now: # the rate limit window has been reset, or not used yet
+            bucket["remaining"] = bucket.get("limit", DEFAULT_LIMIT[resource])
+            # provisional, so the reservations are kept until a response tells the real reset
+            bucket["reset"] = now + WINDOW_SECONDS[resource]
+        if bucket.get("blocked_until", 0) > now:
+            return bucket, -1
+        return bucket, bucket["remaining"]
+
+    def acquire(self, resource="core"):
+        '''
+        Reserve 1 request on the token with the most budget left.
+        Return (token, 0), or (None, seconds to wait) if every token is used up
+        '''
+        now = time.time()
+        with self.locked_state() as state:
+            best_token, best_budget = None, 0
+            for token in self.tokens:
+                _, budget = self.get_budget(state, token, resource, now)
+                if budget > best_budget:
+                    best_token, best_budget = token, budget
+            if best_token is not None:
+                state[self.keys[best_token]][resource]["remaining"] -= 1
+                return best_token, 0
+            # every token is used up, wait until the earliest one is available again: a token blocked by a secondary
+            # rate limit with budget left is available once unblocked, a token without budget at its reset
+            wait_until = []
+            for token in self.tokens:
+                bucket = state[self.keys[token]][resource]
+                if bucket["remaining"] > 0:
+                    wait_until.append(bucket.get("blocked_until", 0))
+                else:
+                    wait_until.append(max(bucket.get("blocked_until", 0), bucket.get("reset", 0)))
+            return None, max(min(wait_until) - now, 1)
+
+    def update(self, token, resource, status, headers, content=b""):
+        '''
+        Update the budget of the token with the rate limit headers of its response.
+        Return True if the response is rejected by a (primary or secondary) rate limit
+        '''
+        now = time.time()
+        remaining = headers.get("X-RateLimit-Remaining")
+        reset = headers.get("X-RateLimit-Reset")
+        limit = headers.get("X-RateLimit-Limit")
+        retry_after = headers.get("Retry-After")
+        rate_limited = False
+        with self.locked_state() as state:
+            bucket, _ = self.get_budget(state, token, resource, now)
+            if limit is not None:
+                bucket["limit"] = int(limit)
+            if remaining is not None and reset is not None:
+                if int(reset) != bucket.get("reset"): # a new window, the headers are authoritative
+                    bucket["remaining"] = int(remaining)
+                else: # same window, other in-flight requests may have reserved more budget
+                    bucket["remaining"] = min(bucket["remaining"], int(remaining))
+                bucket["reset"] = int(reset)
+            if status in [403, 429]:
+                if retry_after is not None: # secondary rate limit
+                    bucket["blocked_until"] = now + int(retry_after)
+                    rate_limited = True
+                elif remaining == "0": # primary rate limit, wait 1 minute if the reset is not told
+                    bucket["blocked_until"] = int(reset) if reset is not None else now + 60
+                    rate_limited = True
+                elif b"rate limit" in content.lower(): # secondary rate limit without Retry-After, wait 1 minute
+                    bucket["blocked_until"] = now + 60
+                    rate_limited = True
+        return rate_limited
+
+    def peek(self, resource="core"):
+        # the token with the most budget left, without reserving any request
+        now = time.time()
+        with self.locked_state() as state:
+            return max(self.tokens, key=lambda token: self.get_budget(state, token, resource, now)[1])
@@ -0,0 +1,59 @@
+# This script is a persistent cache of the verdicts of the commit filter rules, used by 2_clean_commit_info.py
+# 1. A verdict is keyed by the commit sha and the hash of the rule definition (check rule_engine.get_rule_hash),
+#    so after a rule is changed only this rule is evaluated again, and only on commits no unchanged rule rejects
+# 2. It is a sqlite file at {ROOT_PATH}/commit_info/rule_verdicts.sqlite, shared by every language
+# 3. Verdicts of rule definitions no longer in use can be pruned
+import os
+import sqlite3
+
+def get_verdict_cache_path(root_path):
+    return os.path.join(root_path, 'commit_info', 'rule_verdicts.sqlite')
+
+class VerdictCache:
+    def __init__(self, path, batch_size=500):
+        self.path = path
+        self.batch_size = batch_size # shas per query, below the sqlite limit of host parameters
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS verdicts (
+                sha TEXT,
+                rule_hash TEXT,
+                passed INTEGER,
+                PRIMARY KEY (sha, rule_hash)
+            ) WITHOUT ROWID""")
+        self.conn.commit()
+
+    def get(self, shas, rule_hashes):
+        '''
+        Return the cached verdicts of these commits by these rules, {sha: {rule hash: passed}}
+        '''
+        rule_hashes = list(rule_hashes)
+        shas = list(set(shas))
+        verdicts = {}
+        for idx in range(0, len(shas), self.batch_size):
+            batch = shas[idx: idx + self.batch_size]
+            query = f"SELECT sha, rule_hash, passed FROM verdicts WHERE sha IN ({', '.join('?' * len(batch))}) " \
+                    f"AND rule_hash IN ({', '.join('?' * len(rule_hashes))})"
+            for sha, rule_hash, passed in self.conn.execute(query, batch + rule_hashes):
+                verdicts.setdefault(sha, {})[rule_hash] = bool(passed)
+        return verdicts
+
+    def put(self, verdicts):
+        # verdicts: [(sha, rule hash, passed)]
+        self.conn.executemany("INSERT OR REPLACE INTO verdicts VALUES (?, ?, ?)",
+                              [(sha, rule_hash, int(passed)) for sha, rule_hash, passed in verdicts])
+        self.conn.commit()
+
+    def prune(self, rule_hashes):
+        '''
+        Delete the verdicts of the rule definitions not in rule_hashes, return the number of deleted verdicts
+        '''
+        rule_hashes = list(rule_hashes)
+        cursor = self.conn.execute(f"DELETE FROM verdicts WHERE rule_hash NOT IN ({', '.join('?' * len(rule_hashes))})", rule_hashes)
+        self.conn.commit()
+        return cursor.rowcount
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()